@@ -0,0 +1,128 @@
+import json
+import os
+from . import BbgLogger
+
+logger = BbgLogger.logger
+
+DEFAULT_CONTROLLER_PATH = os.path.join(os.path.expanduser('~'), '.BloombergData', 'adaptiveSizing.json')
+
+# (minimum, initial, maximum) of each request size: securities per request, seconds per intraday window and requests in flight
+DEFAULT_LIMITS = {
+    'securities': (1, 50, 1000),
+    'window': (300, 86400, 7 * 86400),
+    'inFlight': (1, 4, 16)
+}
+
+# Amount each size grows by after a request completing within the target latency
+DEFAULT_INCREASE = {
+    'securities': 10,
+    'window': 3600,
+    'inFlight': 1
+}
+
+class BbgAdaptiveController:
+    def __init__(self, path = DEFAULT_CONTROLLER_PATH, limits = None, targetLatency = 10.0, maxPartials = 20, smoothing = 0.3):
+        '''
+        Adaptive request sizing controller.  Measures the latency, PARTIAL_RESPONSE count and rows per second of every request a query sends and adjusts, per request type, the number of securities per request, the length of intraday time windows and the number of requests in flight.  Sizes grow additively while requests complete within targetLatency and are halved as soon as one does not or fails, always staying within limits.  Learned sizes are persisted to path so the next run starts from them.
+
+        Parameters
+        ----------
+        path : string, optional
+            Location of the JSON file the learned sizes are kept in.  Defaults to ~/.BloombergData/adaptiveSizing.json.  Pass None to keep them in memory only.
+        limits : dictionary, optional
+            (minimum, initial, maximum) tuples overriding DEFAULT_LIMITS for any of securities, window (seconds) and inFlight.
+        targetLatency : float, default 10.0
+            Seconds between sending a request and receiving its final response above which sizes are backed off.
+        maxPartials : integer, default 20
+            Number of PARTIAL_RESPONSE messages above which a response is considered too large and the request sizes shrink.
+        smoothing : float, default 0.3
+            Weight of the latest request in the moving averages of latency and rows per second.
+
+        See Also
+        --------
+        BbgDataPoint : Splits its securities into requests sized by the controller when passed one.
+        BbgIntradayBar : Splits its time range into windows sized by the controller when passed one.
+
+        Examples
+        --------
+        >>> import BloombergData as bbg
+
+        >>> controller = bbg.BbgAdaptiveController()
+
+        >>> bbg.BbgDataPoint(fields = ['PX_LAST'], securities = universe, controller = controller).constructDf()
+
+        >>> controller.size('ReferenceDataRequest', 'securities')
+            70
+        '''
+        self.path = path
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(limits or {})
+        self.targetLatency = targetLatency
+        self.maxPartials = maxPartials
+        self.smoothing = smoothing
+        self.settings = self.load()
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    def save(self):
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok = True)
+        # Write then rename so concurrent readers never see a partially written file
+        tempPath = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tempPath, 'w') as f:
+            json.dump(self.settings, f, indent = 1)
+        os.replace(tempPath, self.path)
+
+    def settingsFor(self, requestType):
+        settings = self.settings.setdefault(requestType, {'latency': None, 'rowsPerSecond': None})
+        for name, (minimum, initial, maximum) in self.limits.items():
+            # Limits may have been narrowed since the settings were learned
+            settings[name] = min(max(settings.get(name, initial), minimum), maximum)
+        return settings
+
+    def size(self, requestType, name):
+        return int(self.settingsFor(requestType)[name])
+
+    def record(self, requestType, latency, partials, rows, failed = False):
+        '''
+        Records a completed (or failed) request and adjusts the sizes of its request type.
+        '''
+        settings = self.settingsFor(requestType)
+        rowsPerSecond = rows / max(latency, 1e-6)
+        if failed or latency > self.targetLatency:
+            self.scale(settings, 'securities', 0.5)
+            self.scale(settings, 'window', 0.5)
+            self.scale(settings, 'inFlight', 0.5)
+        elif partials > self.maxPartials:
+            # Responses this large are slow to decode, fewer securities or a shorter window per request spreads them out
+            self.scale(settings, 'securities', 0.75)
+            self.scale(settings, 'window', 0.75)
+        else:
+            self.grow(settings, 'securities')
+            self.grow(settings, 'window')
+            # More requests in flight only help while the terminal keeps up
+            if settings['rowsPerSecond'] is None or rowsPerSecond >= 0.9 * settings['rowsPerSecond']:
+                self.grow(settings, 'inFlight')
+            else:
+                self.scale(settings, 'inFlight', 0.5)
+
+        if not failed:
+            settings['latency'] = self.smooth(settings['latency'], latency)
+            settings['rowsPerSecond'] = self.smooth(settings['rowsPerSecond'], rowsPerSecond)
+        logger.info('{} request: {:.2f}s, {} partials, {} rows, failed {!s}; sizes now {}'.format(requestType, latency, partials, rows, failed, {name: settings[name] for name in self.limits}))
+
+    def grow(self, settings, name):
+        minimum, initial, maximum = self.limits[name]
+        settings[name] = min(settings[name] + DEFAULT_INCREASE[name], maximum)
+
+    def scale(self, settings, name, factor):
+        minimum, initial, maximum = self.limits[name]
+        settings[name] = max(int(settings[name] * factor), minimum)
+
+    def smooth(self, average, value):
+        return value if average is None else (1 - self.smoothing) * average + self.smoothing * value
@@ -4,6 +4,10 @@ from .BbgRefDataService import BbgRefDataService
 import pandas as pd
 import numpy as np
 from . import BbgLogger
+from .BbgProfiler import timedStage
+from .BbgGateway import useGateway, submitQuery
+from .BbgOutput import BbgHistoryColumns, checkOutputFormat, columnsToOutput
+from .BbgLazyHistory import BbgLazyHistory
 
 logger = BbgLogger.logger
 
@@ -17,7 +21,7 @@ ERROR_INFO = blpapi.Name("errorInfo")
 
 
 class BbgDataHistory(BbgRefDataService):
-    def __init__(self, fields, securities, startDate, endDate, perAdjustment = "ACTUAL", perSelection = "MONTHLY", overrides = None):
+    def __init__(self, fields, securities, startDate, endDate, perAdjustment = "ACTUAL", perSelection = "MONTHLY", overrides = None, outputFormat = 'pandas', session = None, fieldCache = None, controller = None):
         '''
             Bloomberg Historical Data query object.  Allows user to input a list of securities and fields for retrieval over a specified time period with the ability to override certain field (as specified in FLDS <GO>) if required.
 
@@ -39,6 +43,14 @@ class BbgDataHistory(BbgRefDataService):
         perSelection : string, default MONTHLY Determines the frequency of the output. To be used in conjunction with Period Adjustment.  Inputs include DAILY, WEEKLY, MONTHLY, QUARTERLY, SEMI_ANNUAL and YEARLY.
         overrides : dictionary, optional
             A dictionary containing key, value pairs of fields and override values to input.
+        outputFormat : string, default pandas
+            The type of table returned by constructDf.  One of pandas, arrow (pyarrow.Table) or polars (polars.DataFrame).  The arrow and polars tables are built directly from the decoded column buffers without an intermediate pandas DataFrame and are laid out with one row per Date and Security and one column per field.
+        session : BbgRefDataService, optional
+            An already started session to run the query on instead of opening a new one.  The session is left open once the query completes.
+        fieldCache : BbgFieldCache, optional
+            Field metadata cache used to reject invalid fields before the request is sent and to type the returned columns.
+        controller : BbgAdaptiveController, optional
+            When passed, the securities are split across several requests sent concurrently, the number of securities per request and of requests in flight being adjusted by the controller from the latency and size of the responses.
         
         See Also
         --------
@@ -75,6 +87,10 @@ class BbgDataHistory(BbgRefDataService):
         self.perAdjustment = perAdjustment
         self.perSelection = perSelection
         self.overrides = overrides
+        self.outputFormat = checkOutputFormat(outputFormat)
+        self.sharedSession = session
+        self.fieldCache = fieldCache
+        self.controller = controller
 
     def constructDf(self):
         '''
@@ -87,7 +103,7 @@ class BbgDataHistory(BbgRefDataService):
 
         Returns
         -------
-        table : DataFrame
+        table : DataFrame, pyarrow.Table or polars.DataFrame depending on outputFormat
 
         Raises
         ------
@@ -126,21 +142,48 @@ class BbgDataHistory(BbgRefDataService):
             2020-01-09	98.74	    99.2	    98.745	    99.205
             2020-01-10	98.725	    99.19	    98.73	    99.195
         '''
-        BbgRefDataService.__init__(self)
-        self.request = self.createRequest(securities = self.securities, fields = self.fields, requestType = "HistoricalDataRequest")
-        self.appendRequestOverrides(request = self.request, overrides = self.overrides)
-        self.appendHistoricalOverrides(request = self.request, startDate = self.startDate, endDate = self.endDate, perAdjustment = self.perAdjustment, perSelection = self.perSelection)
-        self.cid = self.session.sendRequest(self.request)
-        self.bbgRefData = pd.DataFrame()
-
-        for response in self.parseResponse(self.cid):
-            self.bbgRefData = self.bbgRefData.append(self.refDataContentToDf(response))
-        
-        self.bbgRefData = self.bbgRefData.set_index('Security', append = True).pivot(columns='Field').unstack('Security')
-        self.bbgRefData.columns = self.bbgRefData.columns.droplevel(0).swaplevel()
-        
+        self.validateFields()
+        if useGateway():
+            return submitQuery(self)
+        BbgRefDataService.__init__(self, session = self.sharedSession)
+        self.bbgRefData = self.newResponseColumns()
+        if self.controller is not None:
+            requests = ((i, self.createQueryRequest(securities)) for i, securities in enumerate(self.securityChunks("HistoricalDataRequest")))
+            for key, response, final in self.parseControlledResponses(requests, "HistoricalDataRequest", self.responseRows):
+                self.refDataContentToColumns(response, self.bbgRefData)
+        else:
+            self.request = self.createQueryRequest()
+            self.cid = self.session.sendRequest(self.request)
+            for response in self.parseResponse(self.cid):
+                self.refDataContentToColumns(response, self.bbgRefData)
+
+        self.bbgRefData = self.responseColumnsToOutput(self.bbgRefData)
+
         return self.bbgRefData
 
+    def lazy(self, batchSize = 50, memoryCap = 512 * 2**20):
+        '''
+        Returns a BbgLazyHistory handle of this query straight away.  (security, field) blocks are only fetched, decoded and cached when first read, and toDf materializes the DataFrame constructDf returns.
+        '''
+        return BbgLazyHistory(self, batchSize = batchSize, memoryCap = memoryCap, session = self.sharedSession)
+
+    def createQueryRequest(self, securities = None):
+        request = self.createRequest(securities = self.securities if securities is None else securities, fields = self.fields, requestType = "HistoricalDataRequest")
+        self.appendRequestOverrides(request = request, overrides = self.overrides)
+        return self.appendHistoricalOverrides(request = request, startDate = self.startDate, endDate = self.endDate, perAdjustment = self.perAdjustment, perSelection = self.perSelection)
+
+    def responseRows(self, response):
+        return len(response['content']['HistoricalDataResponse']['securityData']['fieldData'])
+
+    def newResponseColumns(self):
+        return BbgHistoryColumns()
+
+    @timedStage('build')
+    def responseColumnsToOutput(self, columns):
+        if self.outputFormat == 'pandas':
+            return self.alignHistoryColumns(columns)
+        return columnsToOutput(self.historyColumnsToTidy(columns), self.outputFormat)
+
     def appendHistoricalOverrides(self, request, startDate, endDate, perAdjustment, perSelection):
         request.set("periodicityAdjustment", perAdjustment)
         request.set("periodicitySelection", perSelection)
@@ -154,13 +197,97 @@ class BbgDataHistory(BbgRefDataService):
         # : request.Set("calendarCodeOverride", "US"); Returns the data based on the calendar of the specified country, Exchange or religion
         return request
 
-    def refDataContentToDf(self, response):
+    @timedStage('decode')
+    def refDataContentToColumns(self, response, columns):
+        '''
+        Decodes a HistoricalDataResponse message into the BbgHistoryColumns buffers held in columns.  Messages for the same security are accumulated so partial responses can be passed in one after another.
+        '''
         securityData = response['content']['HistoricalDataResponse']['securityData']
-        historicalData = securityData['fieldData']
-        returnDf = pd.DataFrame()
-        for snapShot in historicalData:
-            fieldData = snapShot['fieldData']
-            returnDf = returnDf.append(pd.DataFrame(fieldData.items(), columns=['Field', 'Values'], index = [fieldData['date'] for i in range(0, len(fieldData))])[1:])
-        returnDf.index.names = ['Date']
-        returnDf['Security'] = securityData['security']
-        return returnDf
\ No newline at end of file
+        for snapShot in securityData['fieldData']:
+            columns.appendSnapshot(securityData['security'], snapShot['fieldData'])
+        return columns
+
+    def alignHistoryColumns(self, columns):
+        '''
+        Writes the decoded columns straight into a preallocated float matrix indexed by the sorted dates, with a (Security, Field) column for every security and field returned, all NaN where a security returned nothing for a field.  Non-numeric columns are built apart and joined to the matrix in a single concat.
+        '''
+        securities = columns.securities()
+        fields = columns.fields()
+        dates, order = columns.dateOrder()
+        dtypes = self.fieldDtypes()
+        # Columns are laid out field major to match the ordering the pivot/unstack construction produced
+        allColumns = [(security, field) for field in fields for security in securities]
+        numericColumns = {}
+        objectColumns = {}
+        for security, field, rows, values in columns.items():
+            if self.isNumericField(field, values, dtypes):
+                numericColumns[(security, field)] = (rows, values)
+            else:
+                objectColumns[(security, field)] = self.objectColumn(len(dates), order[rows], values)
+
+        matrixColumns = [key for key in allColumns if key not in objectColumns]
+        position = {key: i for i, key in enumerate(matrixColumns)}
+        matrix = np.full((len(dates), len(matrixColumns)), np.nan)
+        for key, (rows, values) in numericColumns.items():
+            matrix[order[rows], position[key]] = values
+
+        index = pd.Index(dates, name = 'Date')
+        returnDf = pd.DataFrame(matrix, index = index, columns = pd.MultiIndex.from_tuples(matrixColumns, names = ['Security', 'Field']), copy = False)
+        if objectColumns:
+            objectDf = pd.DataFrame(objectColumns, index = index)
+            objectDf.columns.names = ['Security', 'Field']
+            returnDf = pd.concat([returnDf, objectDf], axis = 1).reindex(columns = pd.MultiIndex.from_tuples(allColumns, names = ['Security', 'Field']))
+        return returnDf
+
+    def objectColumn(self, length, positions, values):
+        column = np.full(length, None, dtype = object)
+        for position, value in zip(positions, self.objectValues(values)):
+            column[position] = value
+        return column
+
+    def objectValues(self, values):
+        if isinstance(values, np.ndarray):
+            return [None if np.isnan(value) else value for value in values.tolist()]
+        return values
+
+    def historyColumnsToTidy(self, columns):
+        '''
+        Flattens the decoded columns into Date, Security and per field column buffers with one row per date a security returned data for.  Numeric fields are written into float ndarrays, other fields are kept as lists.
+        '''
+        securities = columns.securities()
+        fields = columns.fields()
+        dates, order = columns.dateOrder()
+        dtypes = self.fieldDtypes()
+        bySecurity = {security: {} for security in securities}
+        for security, field, rows, values in columns.items():
+            bySecurity[security][field] = (order[rows], values)
+        numericFields = {field for field in fields if all(self.isNumericField(field, securityColumns[field][1], dtypes) for securityColumns in bySecurity.values() if field in securityColumns)}
+
+        tidyDates = []
+        tidySecurities = []
+        pieces = {field: [] for field in fields}
+        for security in securities:
+            securityColumns = bySecurity[security]
+            # Positions of the security's dates in the sorted dates
+            ranks = np.unique(np.concatenate([positions for positions, _ in securityColumns.values()] or [np.empty(0, dtype = np.intp)]))
+            tidyDates.extend(dates[rank] for rank in ranks)
+            tidySecurities.extend([security] * len(ranks))
+            for field in fields:
+                positions, values = securityColumns.get(field, (np.empty(0, dtype = np.intp), []))
+                rows = np.searchsorted(ranks, positions)
+                if field in numericFields:
+                    piece = np.full(len(ranks), np.nan)
+                    piece[rows] = values
+                else:
+                    piece = self.objectColumn(len(ranks), rows, values)
+                pieces[field].append(piece)
+
+        tidyColumns = {'Date': tidyDates, 'Security': tidySecurities}
+        for field in fields:
+            values = np.concatenate(pieces[field]) if pieces[field] else np.empty(0)
+            tidyColumns[field] = values if field in numericFields else values.tolist()
+        return tidyColumns
+
+    def isNumericField(self, field, values, dtypes):
+        # Columns holding any non-numeric value are decoded as objects, field metadata when available can still ask for objects
+        return isinstance(values, np.ndarray) and dtypes.get(field.upper(), 'float64') in ('float64', 'int64')
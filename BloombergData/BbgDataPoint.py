@@ -1,9 +1,15 @@
 import blpapi
+import copy
+import json
 import logging
 from .BbgRefDataService import BbgRefDataService
 import pandas as pd
 import numpy as np
 from . import BbgLogger
+from .BbgProfiler import timedStage
+from .BbgGateway import useGateway, submitQuery
+from .BbgOutput import BbgColumnBuffer, checkOutputFormat, columnsToOutput
+from .BbgSharedCache import cacheKey
 
 SECURITY_DATA = blpapi.Name("securityData")
 SECURITY = blpapi.Name("security")
@@ -15,7 +21,7 @@ ERROR_INFO = blpapi.Name("errorInfo")
 logger = BbgLogger.logger
 
 class BbgDataPoint(BbgRefDataService):
-    def __init__(self, fields, securities, overrides = None):
+    def __init__(self, fields, securities, overrides = None, outputFormat = 'pandas', session = None, fieldCache = None, controller = None, cache = None):
         '''
             Bloomberg Historical Data query object.  Allows user to input a list of securities and fields for retrieval over a specified time period with the ability to override certain field (as specified in FLDS <GO>) if required.
 
@@ -27,6 +33,16 @@ class BbgDataPoint(BbgRefDataService):
             List of Bloomberg tickers to retrieve data for.  If one item is passed this can be input as a string, otherwise inputs must be passed as a list or array-like.
         overrides : dictionary, optional
             A dictionary containing key, value pairs of fields and override values to input.
+        outputFormat : string, default pandas
+            The type of table returned by constructDf.  One of pandas, arrow (pyarrow.Table) or polars (polars.DataFrame).  The arrow and polars tables are built directly from the decoded column buffers without an intermediate pandas DataFrame.
+        session : BbgRefDataService, optional
+            An already started session to run the query on instead of opening a new one.  The session is left open once the query completes.
+        fieldCache : BbgFieldCache, optional
+            Field metadata cache used to reject invalid fields before the request is sent and to type the returned columns.
+        controller : BbgAdaptiveController, optional
+            When passed, the securities are split across several requests sent concurrently, the number of securities per request and of requests in flight being adjusted by the controller from the latency and size of the responses.
+        cache : BbgSharedCache, optional
+            Reference data cache shared across processes.  Each (security, field) value is read from it when present, only the securities and fields missing are requested and their values stored for the next query.
         
         See Also
         --------
@@ -77,6 +93,11 @@ class BbgDataPoint(BbgRefDataService):
         self.fields = fields
         self.securities = securities
         self.overrides = overrides
+        self.outputFormat = checkOutputFormat(outputFormat)
+        self.sharedSession = session
+        self.fieldCache = fieldCache
+        self.controller = controller
+        self.cache = cache
         
     def constructDf(self):
         '''
@@ -89,7 +110,7 @@ class BbgDataPoint(BbgRefDataService):
 
         Returns
         -------
-        table : DataFrame
+        table : DataFrame, pyarrow.Table or polars.DataFrame depending on outputFormat
 
         Raises
         ------
@@ -145,28 +166,101 @@ class BbgDataPoint(BbgRefDataService):
             AP364296 Corp   	-3.170604	    -3.165165
             AP364296 Corp   	-0.990407	    -0.949785
         '''
-        BbgRefDataService.__init__(self)
-        self.request = self.createRequest(securities = self.securities, fields = self.fields, requestType = "ReferenceDataRequest")
-        self.request = self.appendRequestOverrides(self.request, self.overrides)
-        self.cid = self.session.sendRequest(self.request)
-        self.bbgRefData = pd.DataFrame()
-        for response in self.parseResponse(self.cid):
-            self.bbgRefData = self.bbgRefData.append(self.refDataContentToDf(response))
+        self.validateFields()
+        # Cached queries are read and filled locally by the processes sharing the cache, only the misses go to the gateway when one is set
+        if self.cache is not None:
+            self.bbgRefData = self.responseColumnsToOutput(self.cachedResponseColumns())
+            return self.bbgRefData
+        if useGateway():
+            return submitQuery(self)
+        self.bbgRefData = self.responseColumnsToOutput(self.fetchResponseColumns())
         return self.bbgRefData
 
-    def refDataContentToDf(self, response):
+    def fetchResponseColumns(self):
+        BbgRefDataService.__init__(self, session = self.sharedSession)
+        columns = self.newResponseColumns()
+        if self.controller is not None:
+            requests = ((i, self.createQueryRequest(securities)) for i, securities in enumerate(self.securityChunks("ReferenceDataRequest")))
+            for key, response, final in self.parseControlledResponses(requests, "ReferenceDataRequest", self.responseRows):
+                self.refDataContentToColumns(response, columns)
+        else:
+            self.request = self.createQueryRequest()
+            self.cid = self.session.sendRequest(self.request)
+            for response in self.parseResponse(self.cid):
+                self.refDataContentToColumns(response, columns)
+        return columns
+
+    def cachedResponseColumns(self):
+        securities = [self.securities] if isinstance(self.securities, str) else list(self.securities)
+        keys = {cacheKey('BbgDataPoint', security, field, self.overrides): (security, field) for security in securities for field in self.fields}
+        values = self.cache.fetch(keys, self.fetchCacheKeys, ttlFor = lambda key: self.cache.fieldTtl(keys[key][1]))
+        columns = self.newResponseColumns()
+        for security in securities:
+            row = {}
+            for field in self.fields:
+                key = cacheKey('BbgDataPoint', security, field, self.overrides)
+                if key in values:
+                    row[field] = values[key]
+            if row:
+                row['securities'] = security
+                columns.appendRow(row)
+        return columns
+
+    def fetchCacheKeys(self, keys):
+        # Missing (security, field) pairs are requested as one query over the securities and fields involved
+        requested = [json.loads(key) for key in keys]
+        query = copy.copy(self)
+        query.securities = list(dict.fromkeys(security for kind, security, field, overrides in requested))
+        query.fields = list(dict.fromkeys(field for kind, security, field, overrides in requested))
+        query.sharedSession = self.sharedSession
+        query.controller = self.controller
+        columns = self.gatewayResponseColumns(query) if useGateway() else query.fetchResponseColumns().columns
+        returned = {column.upper(): column for column in columns}
+        fetched = {}
+        for i, security in enumerate(columns['securities']):
+            for field in query.fields:
+                fetched[cacheKey('BbgDataPoint', security, field, self.overrides)] = columns[returned[field.upper()]][i] if field.upper() in returned else None
+        return fetched
+
+    def gatewayResponseColumns(self, query):
+        query.outputFormat = 'arrow'
+        table = submitQuery(query)
+        return {name: table.column(name).to_pylist() for name in table.column_names}
+
+    def createQueryRequest(self, securities = None):
+        request = self.createRequest(securities = self.securities if securities is None else securities, fields = self.fields, requestType = "ReferenceDataRequest")
+        return self.appendRequestOverrides(request, self.overrides)
+
+    def responseRows(self, response):
+        return len(response['content']['ReferenceDataResponse'])
+
+    def newResponseColumns(self):
+        return BbgColumnBuffer(['securities'])
+
+    @timedStage('build')
+    def responseColumnsToOutput(self, columns):
+        if self.outputFormat == 'pandas':
+            return self.columnsToDf(columns)
+        return columnsToOutput(columns.typedColumns(self.fieldDtypes()), self.outputFormat)
+
+    @timedStage('decode')
+    def refDataContentToColumns(self, response, columns):
         responseContent = response['content']
         referenceData = responseContent['ReferenceDataResponse']
-        returnDf = pd.DataFrame()
         for item in referenceData:
-            tempDf = pd.DataFrame(item['securityData']['fieldData']['fieldData'].items(), columns=['Fields', 'Values'])
-            tempDf['securities'] = item['securityData']['security']
-            returnDf = returnDf.append(tempDf)
-        return returnDf.pivot(index = 'securities', columns = 'Fields', values = 'Values')
+            row = {'securities': item['securityData']['security']}
+            row.update(item['securityData']['fieldData']['fieldData'])
+            columns.appendRow(row)
+        return columns
+
+    def columnsToDf(self, columns):
+        returnDf = pd.DataFrame(columns.typedColumns(self.fieldDtypes())).set_index('securities').sort_index().sort_index(axis = 1)
+        returnDf.columns.name = 'Fields'
+        return returnDf
     
     def inspectReponse(self):
         responseList = []
-        BbgRefDataService.__init__(self)
+        BbgRefDataService.__init__(self, session = self.sharedSession)
         self.request = self.createRequest(securities = self.securities, fields = self.fields, requestType = "ReferenceDataRequest")
         self.request = self.appendRequestOverrides(self.request, self.overrides)
         self.cid = self.session.sendRequest(self.request)
@@ -1,9 +1,16 @@
 import blpapi
+import copy
+import itertools
+import json
 import logging
 from .BbgRefDataService import BbgRefDataService
 import pandas as pd
 import numpy as np
 from . import BbgLogger
+from .BbgProfiler import timedStage
+from .BbgGateway import useGateway, submitQuery
+from .BbgOutput import BbgRaggedColumns, checkOutputFormat, columnsToOutput, importArrow
+from .BbgSharedCache import cacheKey
 
 logger = BbgLogger.logger
 
@@ -15,18 +22,26 @@ FIELD_ID = blpapi.Name("fieldId")
 ERROR_INFO = blpapi.Name("errorInfo")
 
 class BbgDataService(BbgRefDataService):
-    def __init__(self, field, securities, overrides = None):
+    def __init__(self, field, securities, overrides = None, outputFormat = 'pandas', session = None, fieldCache = None, cache = None):
         '''
         Bloomberg Bulk Reference Data query object.  Allows user to input a list of securities and fields for retrieval over a specified time period with the ability to override certain field (as specified in FLDS <GO>) if required.
 
         Parameters
         ----------
-        field : string
-            The field to be retrieved, field names and data types can be determined by typing FLDS <GO> and using the search box.  If more than one field is provided will raise a TypeError
+        field : string, tuple, list, or ndarray
+            The bulk field or fields to be retrieved, field names and data types can be determined by typing FLDS <GO> and using the search box.  All fields are retrieved in a single request.
         securities : string, tuple, list, or ndarray
             List of Bloomberg tickers to retrieve data for.  If one item is passed this can be input as a string, otherwise inputs must be passed as a list or array-like.
         overrides : dictionary, optional
             A dictionary containing key, value pairs of fields and override values to input.
+        outputFormat : string, default pandas
+            The type of table returned by constructDf.  One of pandas, arrow (pyarrow.Table) or polars (polars.DataFrame).  The arrow and polars tables are built directly from the decoded column buffers without an intermediate pandas DataFrame.
+        session : BbgRefDataService, optional
+            An already started session to run the query on instead of opening a new one.  The session is left open once the query completes.
+        fieldCache : BbgFieldCache, optional
+            Field metadata cache used to reject invalid and non-bulk fields before the request is sent.  The columns of each bulk field are recorded in the cache so they are known before the next response is decoded.
+        cache : BbgSharedCache, optional
+            Reference data cache shared across processes.  The bulk rows of each (security, field) are read from it when present, only the securities and fields missing are requested and their rows stored for the next query.
         
         See Also
         --------
@@ -54,11 +69,13 @@ class BbgDataService(BbgRefDataService):
         YCGT0025 Index	    4.737	    4.742	    2006-08-30	    4.740	    3Y	    912828FP Govt
         YCGT0025 Index	    4.723	    4.727	    2006-08-30	    4.725	    5Y	    912828FN Govt
         '''
-        self.fields = list(field) if type(field) is not list else field
-        if len(self.fields) > 1:
-            raise TypeError("BbgDataService is only designed to handle a single bulk field per request.")
+        self.fields = [field] if isinstance(field, str) else list(field)
         self.securities = securities
         self.overrides = overrides
+        self.outputFormat = checkOutputFormat(outputFormat)
+        self.sharedSession = session
+        self.fieldCache = fieldCache
+        self.cache = cache
 
     def constructDf(self):
         '''
@@ -70,7 +87,7 @@ class BbgDataService(BbgRefDataService):
 
         Returns
         -------
-        table : DataFrame
+        table : DataFrame, pyarrow.Table or polars.DataFrame depending on outputFormat, or a dictionary of them keyed by field when more than one field was requested
 
         Raises
         ------
@@ -105,39 +122,137 @@ class BbgDataService(BbgRefDataService):
         YCGT0025 Index	    4.809	    4.817	    2006-08-30	    4.813	    2Y	    912828FR Govt
         YCGT0025 Index	    4.737	    4.742	    2006-08-30	    4.740	    3Y	    912828FP Govt
         YCGT0025 Index	    4.723	    4.727	    2006-08-30	    4.725	    5Y	    912828FN Govt
+
+        Retrieve several bulk fields for the same securities in one request
+
+        >>> bulkData = bbg.BbgDataService(field = ['INDX_MEMBERS', 'DVD_HIST_ALL'], securities = ['AS51 Index']).constructDf()
+
+        >>> bulkData['INDX_MEMBERS'].head()
         '''
-        BbgRefDataService.__init__(self)
-        self.request = self.createRequest(securities = self.securities, fields = self.fields, requestType = "ReferenceDataRequest")
-        self.request = self.appendRequestOverrides(request = self.request, overrides = self.overrides)
+        self.validateFields(bulk = True)
+        # Cached queries are read and filled locally by the processes sharing the cache, only the misses go to the gateway when one is set
+        if self.cache is not None:
+            self.bbgRefData = self.responseColumnsToOutput(self.cachedResponseColumns())
+            return self.bbgRefData
+        if useGateway():
+            return submitQuery(self)
+        self.raggedColumns = self.fetchResponseColumns()
+        self.bbgRefData = self.responseColumnsToOutput(self.raggedColumns)
+        return self.bbgRefData
+
+    def fetchResponseColumns(self):
+        BbgRefDataService.__init__(self, session = self.sharedSession)
+        self.request = self.createQueryRequest()
         self.cid = self.session.sendRequest(request = self.request)
-        self.bbgRefData = pd.DataFrame()
+        raggedColumns = self.newResponseColumns()
 
         for response in self.parseResponse(self.cid):
-            self.bbgRefData = self.bbgRefData.append(self.refDataContentToDf(response))
-        
-        return self.bbgRefData
+            self.refDataContentToColumns(response, raggedColumns)
+        return raggedColumns
+
+    def cachedResponseColumns(self):
+        securities = [self.securities] if isinstance(self.securities, str) else list(self.securities)
+        keys = [cacheKey('BbgDataService', security, field, self.overrides) for field in self.fields for security in securities]
+        values = self.cache.fetch(keys, self.fetchCacheKeys, ttlFor = lambda key: self.cache.fieldTtl(json.loads(key)[2]))
+        raggedColumns = self.newResponseColumns()
+        for field, ragged in raggedColumns.items():
+            for security in securities:
+                key = cacheKey('BbgDataService', security, field, self.overrides)
+                if key in values:
+                    rows = values[key]
+                    ragged.appendSecurity(security, [dict(zip(rows, row)) for row in zip(*rows.values())])
+        return raggedColumns
+
+    def fetchCacheKeys(self, keys):
+        # Missing (security, field) pairs are requested as one query over the securities and fields involved
+        requested = [json.loads(key) for key in keys]
+        query = copy.copy(self)
+        query.securities = list(dict.fromkeys(security for kind, security, field, overrides in requested))
+        query.fields = list(dict.fromkeys(field for kind, security, field, overrides in requested))
+        query.sharedSession = self.sharedSession
+        raggedColumns = self.gatewayResponseColumns(query) if useGateway() else query.fetchResponseColumns()
+        # Securities returned without rows for a field are cached as having none
+        returned = {security for ragged in raggedColumns.values() for security in ragged.securities}
+        fetched = {}
+        for field in query.fields:
+            ragged = raggedColumns[field]
+            positions = {security: i for i, security in enumerate(ragged.securities)}
+            for security in returned:
+                rows = {}
+                if security in positions:
+                    i = positions[security]
+                    rows = {column: values[ragged.offsets[i]:ragged.offsets[i + 1]] for column, values in ragged.rows.columns.items()}
+                fetched[cacheKey('BbgDataService', security, field, self.overrides)] = rows
+        return fetched
 
-    def refDataContentToDf(self, response):
+    def gatewayResponseColumns(self, query):
+        # Rebuilt from the per-field tables of the gateway, securities without any row are missing from them so they are not cached and are requested again next time
+        query.outputFormat = 'arrow'
+        output = submitQuery(query)
+        tables = output if isinstance(output, dict) else {query.fields[0]: output}
+        raggedColumns = {}
+        for field in query.fields:
+            table = tables[field]
+            tickers = table.column('BB_TICKER').to_pylist()
+            columns = {name: table.column(name).to_pylist() for name in table.column_names if name != 'BB_TICKER'}
+            ragged = raggedColumns[field] = BbgRaggedColumns(list(columns))
+            for security, positions in itertools.groupby(range(len(tickers)), key = lambda i: tickers[i]):
+                ragged.appendSecurity(security, [{name: values[i] for name, values in columns.items()} for i in positions])
+        return raggedColumns
+
+    def createQueryRequest(self):
+        request = self.createRequest(securities = self.securities, fields = self.fields, requestType = "ReferenceDataRequest")
+        return self.appendRequestOverrides(request = request, overrides = self.overrides)
+
+    def newResponseColumns(self):
+        return {field: BbgRaggedColumns(self.knownBulkColumns(field)) for field in self.fields}
+
+    @timedStage('build')
+    def responseColumnsToOutput(self, raggedColumns):
+        output = {}
+        for field, ragged in raggedColumns.items():
+            if self.fieldCache is not None:
+                self.fieldCache.recordBulkColumns(field, list(ragged.rows.columns))
+            output[field] = self.raggedToOutput(ragged)
+
+        if len(self.fields) == 1:
+            return output[self.fields[0]]
+        return output
+
+    @timedStage('decode')
+    def refDataContentToColumns(self, response, raggedColumns):
+        '''
+        Decodes the bulk rows of every field of a ReferenceDataResponse in a single pass, appending each security's rows to the ragged columns of the field.
+        '''
+        requestedFields = {field.upper(): field for field in raggedColumns}
         responseData = response['content']['ReferenceDataResponse']
-        returnDf = pd.DataFrame()
-        tempDf = pd.DataFrame()
         for security in responseData:
             securityData = security['securityData']
             fieldData = securityData['fieldData']['fieldData']
-            tempDf = pd.DataFrame()
             for fieldK, fieldV in fieldData.items():
-                for val in fieldV:
-                    tempDf = tempDf.append(pd.DataFrame(val.values()),sort=True)
-                    
-            tempDf['BB_TICKER'] = securityData['security']
-            
-            returnDf = returnDf.append(tempDf,sort=True)
-            
-        return returnDf.set_index("BB_TICKER")
-    
+                ragged = raggedColumns.setdefault(requestedFields.get(fieldK.upper(), fieldK), BbgRaggedColumns())
+                # Each bulk row is a single SEQUENCE element keyed by the bulk field name
+                ragged.appendSecurity(securityData['security'], [rowData for val in (fieldV or []) for rowData in val.values()])
+        return raggedColumns
+
+    def raggedToOutput(self, ragged):
+        codes = ragged.securityCodes()
+        if self.outputFormat == 'pandas':
+            returnDf = pd.DataFrame(ragged.rows.columns, index = pd.Index(np.asarray(ragged.securities, dtype = object)[codes], name = 'BB_TICKER'))
+            return returnDf.sort_index(axis = 1)
+        pa = importArrow()
+        columns = {'BB_TICKER': pa.DictionaryArray.from_arrays(pa.array(codes, type = pa.int32()), pa.array(ragged.securities, type = pa.string()))}
+        columns.update(ragged.rows.columns)
+        return columnsToOutput(columns, self.outputFormat)
+
+    def knownBulkColumns(self, field):
+        if self.fieldCache is None:
+            return []
+        return self.fieldCache.bulkColumns(field) or []
+
     def inspectResponse(self):
         responseList = []
-        BbgRefDataService.__init__(self)
+        BbgRefDataService.__init__(self, session = self.sharedSession)
         self.request = self.createRequest(securities = self.securities, fields = self.fields, requestType = "ReferenceDataRequest")
         self.request = self.appendRequestOverrides(self.request, self.overrides)
         self.cid = self.session.sendRequest(self.request)
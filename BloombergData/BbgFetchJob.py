@@ -0,0 +1,217 @@
+import datetime as dt
+import json
+import math
+import os
+import pickle
+import time
+from .BbgRefDataService import BbgRefDataService
+from .BbgOutput import BbgColumnBuffer, concatColumns
+from . import BbgLogger
+
+logger = BbgLogger.logger
+
+MANIFEST_NAME = 'manifest.json'
+
+# Query attributes changing the content of a fetched unit, a job directory is only resumed by a query matching all of them
+REQUEST_ATTRIBUTES = ['fields', 'event', 'barInterval', 'timeZone', 'gapFillInitialBar', 'adjustmentSplit', 'adjustmentAbnormal', 'adjustmentNormal', 'adjustmentFollowDPDF', 'overrides', 'includeConditionCodes']
+
+class BbgFetchJob:
+    def __init__(self, query, path, window = dt.timedelta(days = 1), maxRetries = 3, backoff = 1.0):
+        '''
+        Resumable, checkpointed run of a BbgIntradayBar or BbgIntradayTick query.  The query is split into (security, time window) units.  Each completed unit is spilled to disk and recorded in a manifest under path, so a job interrupted by a failed session or a crash picks up from the manifest and never fetches a completed unit again.
+
+        Parameters
+        ----------
+        query : BbgIntradayBar or BbgIntradayTick
+            The query describing the securities and the full time range to fetch.
+        path : string
+            Directory holding the manifest and the spilled units, created if it does not exist.
+        window : datetime.timedelta, default 1 day
+            Length of the time window of each unit.  The window of a BbgIntradayBar query is rounded up to a whole number of bars so no bar straddles two units.
+        maxRetries : integer, default 3
+            Number of times a failed unit is retried, each time on a new session, before it is marked failed.
+        backoff : float, default 1.0
+            Seconds waited before the first retry of a unit, doubled on every further retry.
+
+        Notes
+        -----
+        A job directory belongs to a single query.  Reusing it for a query over different securities, times, window or request parameters (bar event and interval, time zone, adjustments, tick fields, overrides, condition codes) raises a ValueError rather than mixing the two results.
+
+        See Also
+        --------
+        BbgFetchJob.run : Fetches every unit not yet completed.
+        BbgFetchJob.result : Combines the completed units into the query's output table.
+
+        Examples
+        --------
+        >>> import datetime as dt
+
+        >>> import BloombergData as bbg
+
+        >>> bars = bbg.BbgIntradayBar(securities = ["YMH0 Comdty", "XMH0 Comdty"], startTime = dt.datetime(2020, 1, 1), endTime = dt.datetime(2020, 2, 1), barInterval = 5)
+
+        >>> job = bars.fetchJob('/data/jobs/ym-xm-bars', window = dt.timedelta(days = 7))
+
+        >>> job.run()
+
+        >>> job.result().head()
+        '''
+        self.query = query
+        self.path = path
+        self.window = self.unitWindow(window)
+        self.maxRetries = maxRetries
+        self.backoff = backoff
+        self.session = None
+        os.makedirs(self.path, exist_ok = True)
+        self.manifest = self.loadManifest()
+
+    def unitWindow(self, window):
+        if not hasattr(self.query, 'barInterval'):
+            return window
+        step = 60 * self.query.barInterval
+        rounded = dt.timedelta(seconds = math.ceil(window.total_seconds() / step) * step)
+        if rounded != window:
+            logger.info('Fetch job window {!s} rounded up to {!s}, a multiple of the {} minute bar interval'.format(window, rounded, self.query.barInterval))
+        return rounded
+
+    def description(self):
+        description = {
+            'query': type(self.query).__name__,
+            'securities': list(self.query.securities),
+            'startTime': str(self.query.startTime),
+            'endTime': str(self.query.endTime),
+            'window': self.window.total_seconds()
+        }
+        for name in REQUEST_ATTRIBUTES:
+            if hasattr(self.query, name):
+                description[name] = getattr(self.query, name)
+        if hasattr(self.query, 'tickDictionary'):
+            description['tickDictionary'] = self.query.tickDictionary is not None
+        # Round tripped through JSON so it compares equal to the description read back from a manifest
+        return json.loads(json.dumps(description, default = str))
+
+    def units(self):
+        units = []
+        for security in self.query.securities:
+            start = self.query.startTime
+            while start < self.query.endTime:
+                end = min(start + self.window, self.query.endTime)
+                units.append({'security': security, 'start': start, 'end': end})
+                start = end
+        return units
+
+    def unitKey(self, unit):
+        return '{}|{}|{}'.format(unit['security'], unit['start'].isoformat(), unit['end'].isoformat())
+
+    def loadManifest(self):
+        manifestPath = os.path.join(self.path, MANIFEST_NAME)
+        if not os.path.exists(manifestPath):
+            return {'job': self.description(), 'units': {}}
+        with open(manifestPath, 'r') as f:
+            manifest = json.load(f)
+        if manifest['job'] != self.description():
+            logger.exception('Job directory {} belongs to a different query'.format(self.path))
+            raise ValueError('Job directory {} belongs to a different query: {!r}'.format(self.path, manifest['job']))
+        return manifest
+
+    def saveManifest(self):
+        manifestPath = os.path.join(self.path, MANIFEST_NAME)
+        with open(manifestPath + '.tmp', 'w') as f:
+            json.dump(self.manifest, f, indent = 1)
+        # The manifest is swapped in so a crash never leaves it half written
+        os.replace(manifestPath + '.tmp', manifestPath)
+
+    def pending(self):
+        return [unit for unit in self.units() if self.manifest['units'].get(self.unitKey(unit), {}).get('status') != 'done']
+
+    def run(self):
+        '''
+        Fetches every unit not completed by a previous run, retrying failed units with exponential backoff on a new session.  Units still failing after maxRetries are recorded as failed in the manifest and a RuntimeError listing them is raised once every other unit has been fetched, calling run again retries them.
+        '''
+        pending = self.pending()
+        logger.info('Fetch job {}: {} units pending of {}'.format(self.path, len(pending), len(self.units())))
+        failed = []
+        try:
+            for unit in pending:
+                if not self.runUnit(unit):
+                    failed.append(self.unitKey(unit))
+        finally:
+            self.closeSession()
+        if failed:
+            raise RuntimeError('Fetch job {}: {} units failed after {} retries: {!s}'.format(self.path, len(failed), self.maxRetries, failed))
+        return self
+
+    def runUnit(self, unit):
+        key = self.unitKey(unit)
+        entry = self.manifest['units'].setdefault(key, {'file': 'unit{:06d}.pkl'.format(len(self.manifest['units'])), 'attempts': 0})
+        for attempt in range(self.maxRetries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            entry['attempts'] += 1
+            try:
+                columns = self.trimUnit(unit, self.fetchUnit(unit))
+            except Exception as e:
+                logger.exception('Fetch job unit {} failed on attempt {}: {!s}'.format(key, attempt + 1, e))
+                entry.update(status = 'failed', error = str(e))
+                # The session may be the cause, the retry runs on a new one
+                self.closeSession()
+                continue
+            self.spillUnit(entry['file'], columns)
+            entry.update(status = 'done', rows = len(columns), error = None)
+            self.saveManifest()
+            return True
+        self.saveManifest()
+        return False
+
+    def fetchUnit(self, unit):
+        if self.session is None:
+            self.session = BbgRefDataService()
+        BbgRefDataService.__init__(self.query, session = self.session)
+        return self.query.fetchSecurityColumns(unit['security'], unit['start'], unit['end'], BbgColumnBuffer(['Security']))
+
+    def trimUnit(self, unit, columns):
+        # Rows stamped at the end of a window are returned with it, they belong to the next unit and are only kept by the last one
+        if unit['end'] >= self.query.endTime or not len(columns):
+            return columns
+        end = utcNaive(self.query.requestTimeUTC(unit['end']))
+        keep = [i for i, time in enumerate(columns.columns['time']) if utcNaive(time) < end]
+        if len(keep) == len(columns):
+            return columns
+        trimmed = BbgColumnBuffer()
+        trimmed.columns = {name: [values[i] for i in keep] for name, values in columns.columns.items()}
+        trimmed.length = len(keep)
+        return trimmed
+
+    def spillUnit(self, fileName, columns):
+        unitPath = os.path.join(self.path, fileName)
+        with open(unitPath + '.tmp', 'wb') as f:
+            pickle.dump(columns.columns, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(unitPath + '.tmp', unitPath)
+
+    def loadUnit(self, fileName):
+        with open(os.path.join(self.path, fileName), 'rb') as f:
+            return pickle.load(f)
+
+    def closeSession(self):
+        if self.session is not None:
+            try:
+                self.session.closeSession()
+            except Exception as e:
+                logger.info('Failed to close fetch job session cleanly: {!s}'.format(e))
+            self.session.ownsSession = False
+            self.session = None
+
+    def result(self):
+        '''
+        Returns the query's output table built from the spilled units, in security then time order.  Raises a RuntimeError if any unit has not completed.
+        '''
+        pending = self.pending()
+        if pending:
+            raise RuntimeError('Fetch job {} has {} units not completed, call run first'.format(self.path, len(pending)))
+        parts = [self.loadUnit(self.manifest['units'][self.unitKey(unit)]['file']) for unit in self.units()]
+        return self.query.columnsToTable(concatColumns(parts))
+
+def utcNaive(time):
+    if getattr(time, 'tzinfo', None) is None:
+        return time
+    return time.astimezone(dt.timezone.utc).replace(tzinfo = None)
@@ -0,0 +1,188 @@
+import json
+import os
+import time
+import pandas as pd
+from .BbgRefDataService import BbgRefDataService
+from . import BbgLogger
+
+logger = BbgLogger.logger
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.BloombergData', 'fieldCache.json')
+
+# numpy dtypes of the //blp/apiflds datatypes, fields of any other datatype are kept as objects
+DATATYPE_DTYPES = {
+    'Double': 'float64',
+    'Float32': 'float64',
+    'Float64': 'float64',
+    'Int32': 'int64',
+    'Int64': 'int64',
+    'Bool': 'bool',
+    'Date': 'datetime64[ns]',
+    'Datetime': 'datetime64[ns]'
+}
+
+class BbgFieldInfo(BbgRefDataService):
+    def __init__(self, fields):
+        '''
+        Bloomberg field metadata query object.  Looks up the id, mnemonic, data type, field type and description of fields through the //blp/apiflds service.
+
+        Parameters
+        ----------
+        fields : tuple, list, or ndarray
+            The field mnemonics or ids to look up.
+
+        See Also
+        --------
+        BbgFieldCache : Persistent local cache of field metadata used to type and validate queries.
+
+        Examples
+        --------
+        >>> import BloombergData as bbg
+
+        >>> bbg.BbgFieldInfo(['PX_LAST', 'CURVE_TENOR_RATES']).constructDf()
+                                id              mnemonic            datatype    ftype       description         valid
+            PX_LAST             PR005           PX_LAST             Double      Price       Last Price          True
+            CURVE_TENOR_RATES   DS218           CURVE_TENOR_RATES   Sequence    BulkFormat  Curve Tenor Rates   True
+        '''
+        self.fields = [fields] if isinstance(fields, str) else list(fields)
+
+    def constructDf(self):
+        return pd.DataFrame.from_dict(self.fetchFieldInfo(), orient = 'index')
+
+    def fetchFieldInfo(self):
+        '''
+        Returns a dictionary of field metadata keyed by the upper cased requested field.  Fields the service does not recognise are returned with valid set to False.
+        '''
+        BbgRefDataService.__init__(self, serviceUrl = "//blp/apiflds")
+        self.request = self.service.createRequest("FieldInfoRequest")
+        for field in self.fields:
+            self.request.append("id", field)
+        self.request.set("returnFieldDocumentation", False)
+        self.cid = self.session.sendRequest(self.request)
+        requested = {field.upper() for field in self.fields}
+        fieldInfo = {}
+        for response in self.parseResponse(self.cid):
+            for item in response['content']['fieldResponse']['fieldData']:
+                fieldData = item['fieldData']
+                if fieldData.get('fieldInfo') is not None:
+                    info = fieldData['fieldInfo']['fieldInfo']
+                    entry = {
+                        'id': fieldData['id'],
+                        'mnemonic': info.get('mnemonic'),
+                        'datatype': str(info.get('datatype')),
+                        'ftype': str(info.get('ftype')),
+                        'description': info.get('description'),
+                        'valid': True
+                    }
+                    for key in {str(fieldData['id']).upper(), str(info.get('mnemonic')).upper()} & requested:
+                        fieldInfo[key] = entry
+                else:
+                    fieldInfo[str(fieldData['id']).upper()] = {'id': fieldData['id'], 'valid': False}
+        for field in requested - set(fieldInfo):
+            fieldInfo[field] = {'id': field, 'valid': False}
+        return fieldInfo
+
+class BbgFieldCache:
+    def __init__(self, path = DEFAULT_CACHE_PATH, lookup = None, maxAge = 30):
+        '''
+        Persistent field metadata cache.  Field metadata is looked up through //blp/apiflds the first time a field is seen and kept in a local JSON file, so queries can type their column buffers and reject invalid fields before a request is sent.
+
+        Parameters
+        ----------
+        path : string, optional
+            Location of the JSON cache file.  Defaults to ~/.BloombergData/fieldCache.json.  Pass None to keep the cache in memory only.
+        lookup : callable, optional
+            Function taking a list of fields and returning a dictionary of metadata keyed by upper cased field, in the format returned by BbgFieldInfo.fetchFieldInfo.  Defaults to querying //blp/apiflds, pass staticLookup(metadata) to work offline.
+        maxAge : float, default 30
+            Number of days a cached entry is used before it is looked up again.
+
+        Examples
+        --------
+        >>> import BloombergData as bbg
+
+        >>> fieldCache = bbg.BbgFieldCache()
+
+        >>> bbg.BbgDataPoint(securities = ['MSFT US Equity'], fields = ['PX_LAST', 'PX_LSAT'], fieldCache = fieldCache).constructDf()
+            ValueError: Invalid Bloomberg fields: ['PX_LSAT']
+        '''
+        self.path = path
+        self.lookup = lookupFieldInfo if lookup is None else lookup
+        self.maxAge = maxAge
+        self.fields = self.load()
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    def save(self):
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok = True)
+        # Write then rename so concurrent readers never see a partially written file
+        tempPath = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tempPath, 'w') as f:
+            json.dump(self.fields, f, indent = 1, default = str)
+        os.replace(tempPath, self.path)
+
+    def getFieldInfo(self, fields):
+        fields = [fields] if isinstance(fields, str) else list(fields)
+        expiry = time.time() - self.maxAge * 86400
+        missing = [field for field in fields if field.upper() not in self.fields or self.fields[field.upper()].get('updated', 0) < expiry]
+        if missing:
+            logger.info('Looking up metadata for fields {!s}'.format(missing))
+            for field, entry in self.lookup(missing).items():
+                entry['updated'] = time.time()
+                entry['bulkColumns'] = self.fields.get(field.upper(), {}).get('bulkColumns')
+                self.fields[field.upper()] = entry
+            self.save()
+        return {field: self.fields.get(field.upper(), {'id': field, 'valid': False}) for field in fields}
+
+    def validateFields(self, fields, bulk = None):
+        '''
+        Raises a ValueError listing any field that is not a valid Bloomberg field.  When bulk is True or False the fields must also be, or not be, bulk fields.
+        '''
+        fieldInfo = self.getFieldInfo(fields)
+        invalid = [field for field, info in fieldInfo.items() if not info['valid']]
+        if invalid:
+            logger.exception('Invalid Bloomberg fields: {!s}'.format(invalid))
+            raise ValueError('Invalid Bloomberg fields: {!s}'.format(invalid))
+        if bulk is not None:
+            mismatched = [field for field, info in fieldInfo.items() if self.isBulk(info) != bulk]
+            if mismatched:
+                logger.exception('{} fields: {!s}'.format('Non-bulk' if bulk else 'Bulk', mismatched))
+                raise ValueError('{} fields cannot be retrieved by this query: {!s}'.format('Non-bulk' if bulk else 'Bulk', mismatched))
+        return fieldInfo
+
+    def isBulk(self, info):
+        return info.get('ftype') == 'BulkFormat' or info.get('datatype') == 'Sequence'
+
+    def dtypes(self, fields):
+        return {field: DATATYPE_DTYPES.get(info.get('datatype'), 'object') for field, info in self.getFieldInfo(fields).items()}
+
+    def bulkColumns(self, field):
+        return self.getFieldInfo([field])[field].get('bulkColumns')
+
+    def recordBulkColumns(self, field, columns):
+        entry = self.fields.get(field.upper())
+        if entry is not None and entry.get('bulkColumns') != list(columns):
+            entry['bulkColumns'] = list(columns)
+            self.save()
+
+def lookupFieldInfo(fields):
+    return BbgFieldInfo(fields).fetchFieldInfo()
+
+def staticLookup(metadata):
+    '''
+    Returns a lookup function serving field metadata from a dictionary instead of //blp/apiflds, for use offline and in tests.  Fields missing from metadata are reported as invalid.
+    '''
+    metadata = {field.upper(): info for field, info in metadata.items()}
+    def lookup(fields):
+        fieldInfo = {}
+        for field in fields:
+            entry = dict(metadata.get(field.upper(), {'id': field, 'valid': False}))
+            entry.setdefault('valid', True)
+            fieldInfo[field.upper()] = entry
+        return fieldInfo
+    return lookup
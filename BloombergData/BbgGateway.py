@@ -0,0 +1,218 @@
+import os
+import pickle
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+import hashlib
+from .BbgSession import BbgManagedSession
+from .BbgOutput import outputToArrow, arrowToOutput, importArrow
+from . import BbgLogger
+
+logger = BbgLogger.logger
+
+# Query classes submit to the gateway listening on this Unix socket when it is set
+GATEWAY_ENV = 'BBG_GATEWAY_SOCKET'
+gatewayAddress = os.environ.get(GATEWAY_ENV)
+
+STATUS_OK = b'\x00'
+STATUS_ERROR = b'\x01'
+# Followed by (name, Arrow IPC stream) pairs each prefixed by its length, for queries returning a dictionary of tables
+STATUS_TABLES = b'\x02'
+FRAME_HEADER = struct.Struct('>Q')
+
+# Set inside the gateway process so the queries it runs are not sent back to itself
+_serving = False
+
+def setGatewayAddress(address):
+    '''
+    Routes the constructDf calls of every query class in this process through the gateway listening on address.  Passing None switches back to each query opening its own session.  The address can also be set through the BBG_GATEWAY_SOCKET environment variable.
+    '''
+    global gatewayAddress
+    gatewayAddress = address
+
+def useGateway():
+    return gatewayAddress is not None and not _serving
+
+def sendFrame(sock, payload):
+    sock.sendall(FRAME_HEADER.pack(len(payload)))
+    sock.sendall(payload)
+
+def recvFrame(sock):
+    header = recvExactly(sock, FRAME_HEADER.size)
+    return recvExactly(sock, FRAME_HEADER.unpack(header)[0])
+
+def recvExactly(sock, length):
+    payload = bytearray(length)
+    view = memoryview(payload)
+    received = 0
+    while received < length:
+        count = sock.recv_into(view[received:], length - received)
+        if count == 0:
+            raise ConnectionError("Bloomberg gateway connection closed after {} of {} bytes".format(received, length))
+        received += count
+    return payload
+
+def submitQuery(query, address = None):
+    '''
+    Runs query in the gateway process and returns the result in the query's outputFormat.  The result is transferred as an Arrow IPC stream, one per table for queries returning a dictionary of tables, and read without copying the received buffer.
+    '''
+    address = gatewayAddress if address is None else address
+    logger.info('Submitting {} query to Bloomberg gateway at {!s}'.format(type(query).__name__, address))
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(address)
+        sendFrame(sock, pickle.dumps(query, protocol = pickle.HIGHEST_PROTOCOL))
+        response = recvFrame(sock)
+    if response[:1] == STATUS_ERROR:
+        logger.exception('Bloomberg gateway failed to run query: {}'.format(bytes(response[1:]).decode()))
+        raise RuntimeError('Bloomberg gateway failed to run query: {}'.format(bytes(response[1:]).decode()))
+    view = memoryview(response)[1:]
+    if response[:1] == STATUS_OK:
+        return arrowToOutput(readStream(view), query.outputFormat)
+
+    outputs = {}
+    offset = 0
+    while offset < len(view):
+        name, offset = readSection(view, offset)
+        table, offset = readSection(view, offset)
+        outputs[bytes(name).decode()] = arrowToOutput(readStream(table), query.outputFormat)
+    return outputs
+
+def readSection(view, offset):
+    length = FRAME_HEADER.unpack_from(view, offset)[0]
+    offset += FRAME_HEADER.size
+    return view[offset:offset + length], offset + length
+
+def readStream(view):
+    pa = importArrow()
+    return pa.ipc.open_stream(pa.py_buffer(view)).read_all()
+
+def writeStream(output):
+    pa = importArrow()
+    sink = pa.BufferOutputStream()
+    table = outputToArrow(output)
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+class BbgGateway:
+    def __init__(self, address = None, poolSize = 2, cacheTtl = 0):
+        '''
+        Local query gateway.  Owns a pool of managed Bloomberg sessions, reconnected in the background whenever the connection to the terminal drops, and a result cache and runs BbgDataPoint, BbgDataHistory, BbgDataService, BbgIntradayBar and BbgIntradayTick queries on behalf of client processes connecting over a Unix socket.
+
+        Parameters
+        ----------
+        address : string, optional
+            Path of the Unix socket to listen on.  Defaults to the BBG_GATEWAY_SOCKET environment variable.
+        poolSize : integer, default 2
+            Number of Bloomberg sessions opened by the gateway.  Each session runs one query at a time, so this is also the number of queries in flight.
+        cacheTtl : float, default 0
+            Number of seconds identical queries are served from the result cache.  0 disables the cache.
+
+        Notes
+        -----
+        Queries are sent to the gateway pickled, the socket is therefore created readable and writable by its owner only and must not be exposed to other users.
+
+        Examples
+        --------
+        Start the gateway in its own process
+
+        >>> python -m BloombergData.BbgGateway /tmp/bbg-gateway.sock
+
+        and switch the query classes of a client process over to it
+
+        >>> import BloombergData as bbg
+
+        >>> bbg.setGatewayAddress('/tmp/bbg-gateway.sock')
+
+        >>> bbg.BbgDataPoint(securities = ['MSFT US Equity'], fields = ['PX_LAST']).constructDf()
+        '''
+        self.address = gatewayAddress if address is None else address
+        if self.address is None:
+            raise ValueError("A socket address must be passed or set through {}".format(GATEWAY_ENV))
+        self.poolSize = poolSize
+        self.cacheTtl = cacheTtl
+        self.pool = queue.Queue()
+        self.cache = {}
+        self.cacheLock = threading.Lock()
+        self.server = None
+
+    def serveForever(self):
+        global _serving
+        _serving = True
+        for i in range(self.poolSize):
+            self.pool.put(BbgManagedSession().start())
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        self.server = socketserver.ThreadingUnixStreamServer(self.address, BbgGatewayHandler)
+        self.server.daemon_threads = True
+        self.server.gateway = self
+        os.chmod(self.address, 0o600)
+        logger.info('Bloomberg gateway listening on {!s} with {} sessions'.format(self.address, self.poolSize))
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            os.unlink(self.address)
+            while not self.pool.empty():
+                self.pool.get().closeSession()
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+
+    def runQuery(self, payload):
+        key = hashlib.sha1(payload).hexdigest()
+        if self.cacheTtl > 0:
+            with self.cacheLock:
+                cached = self.cache.get(key)
+            if cached is not None and time.monotonic() - cached[0] < self.cacheTtl:
+                logger.info('Serving query {} from the gateway cache'.format(key))
+                return cached[1]
+
+        query = pickle.loads(payload)
+        session = self.pool.get()
+        try:
+            query.sharedSession = session
+            output = query.constructDf()
+        finally:
+            query.sharedSession = None
+            self.pool.put(session)
+
+        if isinstance(output, dict):
+            result = [STATUS_TABLES]
+            for name, table in output.items():
+                name = str(name).encode()
+                stream = writeStream(table)
+                result += [FRAME_HEADER.pack(len(name)), name, FRAME_HEADER.pack(stream.size), stream]
+        else:
+            result = [STATUS_OK, writeStream(output)]
+
+        if self.cacheTtl > 0:
+            with self.cacheLock:
+                self.cache[key] = (time.monotonic(), result)
+        return result
+
+class BbgGatewayHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            payload = recvFrame(self.request)
+            result = self.server.gateway.runQuery(bytes(payload))
+        except Exception as e:
+            logger.exception('Bloomberg gateway query failed')
+            sendFrame(self.request, STATUS_ERROR + '{}: {!s}'.format(type(e).__name__, e).encode())
+        else:
+            self.request.sendall(FRAME_HEADER.pack(sum(memoryview(part).nbytes for part in result)))
+            for part in result:
+                self.request.sendall(memoryview(part))
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description = 'Run a local Bloomberg query gateway.')
+    parser.add_argument('address', nargs = '?', default = gatewayAddress, help = 'Unix socket path to listen on')
+    parser.add_argument('--pool-size', type = int, default = 2)
+    parser.add_argument('--cache-ttl', type = float, default = 0)
+    args = parser.parse_args()
+    BbgGateway(args.address, poolSize = args.pool_size, cacheTtl = args.cache_ttl).serveForever()
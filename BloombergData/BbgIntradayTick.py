@@ -1,10 +1,15 @@
+import copy
 import datetime as dt
 import blpapi
 import logging
-from BbgRefDataService import BbgRefDataService
+from .BbgRefDataService import BbgRefDataService
 import pandas as pd
 import numpy as np
-import BbgLogger
+from . import BbgLogger
+from .BbgProfiler import timedStage
+from .BbgGateway import useGateway, submitQuery
+from .BbgOutput import BbgColumnBuffer, checkOutputFormat, columnsToOutput, concatColumns, importArrow, importPolars
+from .BbgFetchJob import BbgFetchJob
 
 logger = BbgLogger.logger
 
@@ -18,25 +23,155 @@ ERROR_INFO = blpapi.Name("errorInfo")
 
 
 class BbgIntradayTick(BbgRefDataService):
-    def __init__(self, fields, securities, startTime, endTime, overrides = None):
+    def __init__(self, fields, securities, startTime, endTime, overrides = None, outputFormat = 'pandas', session = None, includeConditionCodes = True, tickDictionary = None, controller = None):
+        '''
+            Bloomberg Intraday Tick query object.  Allows user to input a list of securities and event types for tick level retrieval over a specified time period.
+
+        Parameters
+        ----------
+        fields : tuple, list, or ndarray
+            The event types to be retrieved, e.g. TRADE, BID or ASK.
+        securities : tuple, list, or ndarray
+            List of Bloomberg tickers to retrieve data for.
+        startTime : datetime.datetime
+            The start date and time (UTC) at which to retrieving data from.
+        endTime : datetime.datetime
+            The end date and time (UTC) at which to retrieving data up to.
+        outputFormat : string, default pandas
+            The type of table returned by constructDf.  One of pandas, arrow (pyarrow.Table) or polars (polars.DataFrame).
+        session : BbgRefDataService, optional
+            An already started session to run the query on instead of opening a new one.  The session is left open once the query completes.
+        includeConditionCodes : bool, default True
+            Request the condition codes of each tick.  Leaving them out when they are not needed reduces the size of the response.
+        tickDictionary : BbgTickDictionary, optional
+            When passed, the type column is returned as uint8 event type codes and the conditionCodes column as uint64 condition flag bitmasks interned in this dictionary instead of strings.  Share one dictionary across the tick queries of a session to keep their codes comparable.
+        controller : BbgAdaptiveController, optional
+            When passed, the time range of each security is split into windows requested concurrently, the window length and number of requests in flight being adjusted by the controller from the latency and size of the responses.
+
+        See Also
+        --------
+        BbgIntradayTick.constructDf : Constructor method, retrieves data associated with a BbgIntradayTick query object and generates a dataframe from it.
+        BbgIntradayTick.fillStore : Incrementally fills a BbgTickStore with tick data.
+        BbgIntradayTick.fetchJob : Runs the query as a resumable job checkpointed per security and time window.
+        BbgTickDictionary : Encodes and filters tick event types and condition codes.
+        '''
         self.fields = list(fields) if type(fields) is not list else fields
         self.securities = list(securities) if type(securities) is not list else securities
         self.startTime = startTime
         self.endTime = endTime
         self.overrides = overrides
+        self.outputFormat = checkOutputFormat(outputFormat)
+        self.sharedSession = session
+        self.includeConditionCodes = includeConditionCodes
+        self.tickDictionary = tickDictionary
+        self.controller = controller
 
     def constructDf(self):
-        BbgRefDataService.__init__(self)
-        self.bbgRefData = pd.DataFrame()
+        if useGateway():
+            return self.submitToGateway()
+        BbgRefDataService.__init__(self, session = self.sharedSession)
+        if self.controller is not None:
+            return self.columnsToTable(self.fetchWindowColumns())
+        self.bbgRefData = BbgColumnBuffer(['Security'])
         
         for sec in self.securities:
-            self.request = self.createIntradayRequest(security = sec, requestType = "IntradayTickRequest", fields = self.fields,
-                                                 startTime = self.startTime, endTime = self.endTime)
-            self.cid = self.session.sendRequest(self.request)
-            for response in self.parseResponse(self.cid, False):
-                self.bbgRefData = self.bbgRefData.append(self.refDataContentToDf(response, sec))
+            self.fetchSecurityColumns(sec, self.startTime, self.endTime, self.bbgRefData)
         BbgRefDataService.__del__(self)
-        return self.bbgRefData.set_index(['Security', 'time'])
+        return self.columnsToTable(self.bbgRefData.columns)
+
+    def fetchWindowColumns(self):
+        # Windows complete out of order, each is decoded into its own buffer and concatenated in security then time order
+        buffers = {}
+
+        def requests():
+            for window in self.timeWindows("IntradayTickRequest"):
+                buffers[window] = BbgColumnBuffer(['Security'])
+                yield window, self.createSecurityRequest(*window)
+
+        for window, response, final in self.parseControlledResponses(requests(), "IntradayTickRequest", self.responseRows):
+            self.refDataContentToColumns(response, window[0], buffers[window])
+        return concatColumns([columns.columns for columns in buffers.values()])
+
+    @timedStage('build')
+    def columnsToTable(self, columns):
+        columns = self.encodeTickColumns(columns)
+        if self.outputFormat == 'pandas':
+            return pd.DataFrame(columns).set_index(['Security', 'time'])
+        return columnsToOutput(columns, self.outputFormat)
+
+    def submitToGateway(self):
+        if self.tickDictionary is None:
+            return submitQuery(self)
+        # Codes must be interned in the caller's dictionary, so the gateway returns the raw strings and they are encoded here
+        remote = copy.copy(self)
+        remote.tickDictionary = None
+        return self.encodeTickOutput(submitQuery(remote))
+
+    def encodeTickOutput(self, output):
+        names = output.column_names if self.outputFormat == 'arrow' else list(output.columns)
+        raw = {name: output[name].to_pylist() if self.outputFormat == 'arrow' else list(output[name].to_numpy()) for name in ['type', 'conditionCodes'] if name in names}
+        encoded = self.encodeTickColumns(raw)
+        if self.outputFormat == 'pandas':
+            return output.assign(**encoded)
+        elif self.outputFormat == 'arrow':
+            pa = importArrow()
+            for name, values in encoded.items():
+                output = output.set_column(output.column_names.index(name), name, pa.array(values))
+            return output
+        return output.with_columns([importPolars().Series(name, values) for name, values in encoded.items()])
+
+    def encodeTickColumns(self, columns):
+        if self.tickDictionary is None:
+            return columns
+        columns = dict(columns)
+        if 'type' in columns:
+            columns['type'] = self.tickDictionary.encodeTypes(columns['type'])
+        if 'conditionCodes' in columns:
+            columns['conditionCodes'] = self.tickDictionary.encodeConditions(columns['conditionCodes'])
+        return columns
+
+    def createSecurityRequest(self, security, startTime, endTime):
+        return self.createIntradayRequest(security = security, requestType = "IntradayTickRequest", fields = self.fields,
+                                          startTime = startTime, endTime = endTime, includeConditionCodes = self.includeConditionCodes)
+
+    def requestTimeUTC(self, time):
+        # Tick times are requested in UTC
+        return time
+
+    def responseRows(self, response):
+        return len(response['content']['IntradayTickResponse']['tickData']['tickData'])
+
+    def fetchSecurityColumns(self, security, startTime, endTime, columns):
+        self.request = self.createSecurityRequest(security, startTime, endTime)
+        self.cid = self.session.sendRequest(self.request)
+        for response in self.parseResponse(self.cid, False):
+            self.refDataContentToColumns(response, security, columns)
+        return columns
+
+    def fillStore(self, store):
+        '''
+        Fills a BbgTickStore with the ticks of every security between startTime and endTime (UTC), only requesting the intervals the store does not already hold for each security.  Intervals are only recorded as held up to the time they were requested, so an endTime in the future is filled in by a later call.
+        '''
+        BbgRefDataService.__init__(self, session = self.sharedSession)
+        try:
+            for sec in self.securities:
+                # Ticks after the time of the request have not happened yet and must not be recorded as held
+                fetchedUntil = min(self.endTime, dt.datetime.now(dt.timezone.utc).replace(tzinfo = None))
+                missing = store.missingIntervals(sec, self.startTime, fetchedUntil) if self.startTime < fetchedUntil else []
+                if not missing:
+                    logger.info('Tick store already holds {} from {!s} to {!s}'.format(sec, self.startTime, fetchedUntil))
+                for startTime, endTime in missing:
+                    columns = self.fetchSecurityColumns(sec, startTime, endTime, BbgColumnBuffer(['Security']))
+                    store.append(sec, columns.columns, covered = (startTime, endTime))
+        finally:
+            BbgRefDataService.__del__(self)
+        return store
+
+    def fetchJob(self, path, window = dt.timedelta(hours = 1), maxRetries = 3, backoff = 1.0):
+        '''
+        Returns a resumable BbgFetchJob of this query checkpointing each (security, time window) unit under path.
+        '''
+        return BbgFetchJob(self, path, window = window, maxRetries = maxRetries, backoff = backoff)
 
     def appendHistoricalOverrides(self, request, startDate, endDate, perAdjustment, perSelection):
         request.set("periodicityAdjustment", perAdjustment)
@@ -46,13 +181,12 @@ class BbgIntradayTick(BbgRefDataService):
 
         return request
 
-    def refDataContentToDf(self, response, security):
+    @timedStage('decode')
+    def refDataContentToColumns(self, response, security, columns):
         securityData = response['content']['IntradayTickResponse']['tickData']
         tickData = securityData['tickData']
-        returnDf = pd.DataFrame()
         for snapShot in tickData:
-            fieldData = snapShot['tickData']
-            returnDf = returnDf.append(pd.DataFrame(fieldData.items(), columns=['Field', 'Values']).set_index('Field').transpose().reset_index(drop=True))#, index = [fieldData['time'] for i in range(0, len(fieldData))])[1:])
-        returnDf.index.names = ['time']
-        returnDf['Security'] = security
-        return returnDf
\ No newline at end of file
+            row = {'Security': security}
+            row.update(snapShot['tickData'])
+            columns.appendRow(row)
+        return columns
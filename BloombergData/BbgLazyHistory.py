@@ -0,0 +1,183 @@
+import collections
+import pandas as pd
+from .BbgRefDataService import BbgRefDataService
+from .BbgGateway import useGateway
+from . import BbgLogger
+
+logger = BbgLogger.logger
+
+class BbgLazyHistory:
+    def __init__(self, query, batchSize = 50, memoryCap = 512 * 2**20, session = None):
+        '''
+        Lazy, column on demand result handle of a BbgDataHistory query.  No data is requested until a (security, field) block is first read.  Blocks are then fetched in batches of securities for the field read, filled with the most frequently read blocks not yet cached, and the least read blocks are evicted once the cached blocks exceed memoryCap.
+
+        Parameters
+        ----------
+        query : BbgDataHistory
+            The query describing the securities, fields, dates and overrides of the full result.
+        batchSize : integer, default 50
+            Maximum number of securities requested together when a block is fetched.
+        memoryCap : integer, default 512MB
+            Number of bytes of cached blocks above which blocks are evicted.
+        session : BbgRefDataService, optional
+            An already started session to fetch blocks on.  By default a session is opened on the first fetch and kept until close is called.
+
+        See Also
+        --------
+        BbgDataHistory.lazy : Returns a lazy result handle of a query.
+        BbgLazyHistory.toDf : Materializes the full Date x (Security, Field) DataFrame.
+
+        Examples
+        --------
+        >>> import BloombergData as bbg
+
+        >>> history = bbg.BbgDataHistory(fields = ['PX_LAST', 'PX_BID'], securities = ['YM1 Comdty', 'XM1 Comdty'], startDate = '20200106', endDate = '20200110', perSelection = 'DAILY').lazy()
+
+        >>> history['YM1 Comdty', 'PX_LAST']
+            Date
+            2020-01-06    99.22
+            2020-01-07    99.22
+        '''
+        self.query = query
+        self.securities = [query.securities] if isinstance(query.securities, str) else list(query.securities)
+        self.fields = [query.fields] if isinstance(query.fields, str) else list(query.fields)
+        self.batchSize = batchSize
+        self.memoryCap = memoryCap
+        self.sharedSession = session
+        self.ownSession = None
+        self.blocks = collections.OrderedDict()
+        self.blockBytes = {}
+        self.accessCounts = collections.Counter()
+        self.nbytes = 0
+        # Securities and fields some batch returned data for, toDf has a column for every pair of them like constructDf
+        self.returnedSecurities = set()
+        self.returnedFields = set()
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            return self.column(*key)
+        keys = list(key)
+        blocks = self.prefetch(keys)
+        return pd.concat({key: blocks[key] for key in keys}, axis = 1, names = ['Security', 'Field'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def column(self, security, field):
+        key = (security, field)
+        self.checkKey(key)
+        self.accessCounts[key] += 1
+        if key not in self.blocks:
+            # The block read is returned from the fetch since a memoryCap smaller than the batch may not leave it cached
+            return self.fetch(field, self.batchFor(key), protect = [key])[key]
+        self.blocks.move_to_end(key)
+        return self.blocks[key]
+
+    def checkKey(self, key):
+        security, field = key
+        if security not in self.securities or field not in self.fields:
+            raise KeyError('{!r} is not part of the query'.format(key))
+
+    def batchFor(self, key):
+        security, field = key
+        # The most read securities not cached for this field go first, the rest of the universe fills the batch in order
+        missing = [other for other in self.securities if other != security and (other, field) not in self.blocks]
+        missing.sort(key = lambda other: -self.accessCounts[(other, field)])
+        return [security] + missing[:self.batchSize - 1]
+
+    def prefetch(self, keys):
+        '''
+        Fetches every block in keys not already cached, batching the securities of each field, and returns a dictionary of the blocks of keys.  None of the blocks of keys are evicted by the fetches.
+        '''
+        keys = list(dict.fromkeys(keys))
+        for key in keys:
+            self.checkKey(key)
+            self.accessCounts[key] += 1
+        blocks = {key: self.blocks[key] for key in keys if key in self.blocks}
+        byField = collections.OrderedDict()
+        for security, field in keys:
+            if (security, field) not in blocks:
+                byField.setdefault(field, []).append(security)
+        for field, securities in byField.items():
+            for i in range(0, len(securities), self.batchSize):
+                blocks.update(self.fetch(field, securities[i:i + self.batchSize], protect = keys))
+        return blocks
+
+    def fetch(self, field, securities, protect = ()):
+        logger.info('Fetching {} history for {} securities'.format(field, len(securities)))
+        # The batch shares the base query's field cache and controller but not its session or results
+        batch = self.query.clone()
+        batch.securities = securities
+        batch.fields = [field]
+        batch.outputFormat = 'pandas'
+        batch.sharedSession = self.session()
+        result = batch.constructDf()
+        fetched = {}
+        for security in securities:
+            if (security, field) in result.columns:
+                block = result[(security, field)].dropna()
+                self.returnedSecurities.add(security)
+                self.returnedFields.add(field)
+            else:
+                block = pd.Series([], index = pd.Index([], name = 'Date'), dtype = float)
+            block.name = (security, field)
+            fetched[(security, field)] = block
+            self.store((security, field), block)
+        self.evict(protect)
+        return fetched
+
+    def session(self):
+        if self.sharedSession is not None:
+            return self.sharedSession
+        if self.ownSession is None and not useGateway():
+            self.ownSession = BbgRefDataService()
+        return self.ownSession
+
+    def store(self, key, block):
+        if key in self.blocks:
+            self.nbytes -= self.blockBytes[key]
+        self.blocks[key] = block
+        self.blockBytes[key] = int(block.memory_usage(index = True, deep = True))
+        self.nbytes += self.blockBytes[key]
+
+    def evict(self, protect = ()):
+        # Least read blocks go first, ties broken by least recently read.  Blocks being read are never evicted, so the cache may stay above memoryCap until the next fetch.
+        protect = set(protect)
+        while self.nbytes > self.memoryCap:
+            candidates = [key for key in self.blocks if key not in protect]
+            if not candidates:
+                break
+            key = min(candidates, key = lambda block: self.accessCounts[block])
+            self.blocks.pop(key)
+            self.nbytes -= self.blockBytes.pop(key)
+            logger.info('Evicted history block {!r}'.format(key))
+
+    def toDf(self):
+        '''
+        Returns the same Date x (Security, Field) DataFrame the query's constructDf returns, fetching any block not cached.  Blocks are assembled from this call's fetches rather than the cache, so memoryCap does not have to hold the full result.
+        '''
+        columns = {}
+        for field in self.fields:
+            for i in range(0, len(self.securities), self.batchSize):
+                securities = self.securities[i:i + self.batchSize]
+                for security in securities:
+                    if (security, field) in self.blocks:
+                        columns[(security, field)] = self.blocks[(security, field)]
+                missing = [security for security in securities if (security, field) not in columns]
+                if missing:
+                    columns.update(self.fetch(field, missing))
+        # Columns are laid out field major like the ones of constructDf, a security returning nothing for a field gets an all NaN column
+        order = [(security, field) for field in sorted(self.returnedFields) for security in sorted(self.returnedSecurities)]
+        if not order:
+            return pd.DataFrame(index = pd.Index([], name = 'Date'), columns = pd.MultiIndex.from_tuples([], names = ['Security', 'Field']))
+        returnDf = pd.concat([columns[key] for key in order], axis = 1, keys = order, names = ['Security', 'Field']).sort_index()
+        returnDf.index.name = 'Date'
+        return returnDf
+
+    def close(self):
+        if self.ownSession is not None:
+            self.ownSession.closeSession()
+            self.ownSession = None
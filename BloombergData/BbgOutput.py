@@ -0,0 +1,209 @@
+from array import array
+import numpy as np
+from . import BbgLogger
+
+logger = BbgLogger.logger
+
+OUTPUT_FORMATS = ['pandas', 'arrow', 'polars']
+
+class BbgColumnBuffer:
+    def __init__(self, columns = ()):
+        '''
+        Row-appendable set of column buffers used by the query classes to decode responses before a table is built.  Columns that first appear part way through decoding are back-filled with None so every column always has the same length.
+        '''
+        self.columns = {column: [] for column in columns}
+        self.length = 0
+
+    def appendRow(self, row):
+        for column, value in row.items():
+            if column not in self.columns:
+                self.columns[column] = [None] * self.length
+            self.columns[column].append(value)
+        self.length += 1
+        for values in self.columns.values():
+            if len(values) < self.length:
+                values.append(None)
+
+    def typedColumns(self, dtypes = None):
+        '''
+        Returns the column buffers with every column named in dtypes (matched on the upper cased column name) converted to a typed ndarray.
+        '''
+        dtypes = {} if dtypes is None else dtypes
+        return {column: typedColumn(values, dtypes[column.upper()]) if column.upper() in dtypes else values for column, values in self.columns.items()}
+
+    def __len__(self):
+        return self.length
+
+class BbgRaggedColumns:
+    def __init__(self, columns = ()):
+        '''
+        Flat column buffers holding the bulk rows of every security back to back.  Rows offsets[i] to offsets[i + 1] belong to securities[i], the same layout as an Arrow list array.
+        '''
+        self.securities = []
+        self.offsets = [0]
+        self.rows = BbgColumnBuffer(columns)
+
+    def appendSecurity(self, security, rows):
+        for row in rows:
+            self.rows.appendRow(row)
+        self.securities.append(security)
+        self.offsets.append(len(self.rows))
+
+    def securityCodes(self):
+        return np.repeat(np.arange(len(self.securities)), np.diff(self.offsets))
+
+    def rowsFor(self, security):
+        i = self.securities.index(security)
+        return {column: values[self.offsets[i]:self.offsets[i + 1]] for column, values in self.rows.columns.items()}
+
+    def __len__(self):
+        return len(self.rows)
+
+class BbgHistoryColumns:
+    def __init__(self):
+        '''
+        Column buffers of historical data.  Each date gets a row number as it first arrives and every (security, field) keeps the rows it returned values for next to the values themselves.  Numeric values go into array('d') buffers so no boxed float is held per data point, a column holding any other value is kept as a list of objects.
+        '''
+        self.datePosition = {}
+        self.columns = {}
+
+    def appendSnapshot(self, security, fieldData):
+        row = self.datePosition.setdefault(fieldData['date'], len(self.datePosition))
+        securityColumns = self.columns.setdefault(security, {})
+        for field, value in fieldData.items():
+            if field == 'date':
+                continue
+            column = securityColumns.get(field)
+            if column is None:
+                column = securityColumns[field] = (array('q'), [array('d')])
+            rows, values = column
+            rows.append(row)
+            if isinstance(values[0], array):
+                if value is None:
+                    values[0].append(np.nan)
+                    continue
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    values[0].append(value)
+                    continue
+                # The first non-numeric value turns the column into objects, missing values stay None
+                values[0] = [None if np.isnan(stored) else stored for stored in values[0]]
+            values[0].append(value)
+
+    def dateOrder(self):
+        '''
+        Returns the dates in sorted order and, indexed by arrival row number, the position of each date in that order.
+        '''
+        dates = sorted(self.datePosition)
+        order = np.empty(len(dates), dtype = np.intp)
+        order[np.fromiter((self.datePosition[date] for date in dates), dtype = np.intp, count = len(dates))] = np.arange(len(dates))
+        return dates, order
+
+    def securities(self):
+        return sorted(self.columns)
+
+    def fields(self):
+        return sorted({field for securityColumns in self.columns.values() for field in securityColumns})
+
+    def items(self):
+        '''
+        Yields (security, field, rows, values) for every column, rows as an int64 ndarray of arrival row numbers and values as a float64 ndarray, or a list for object columns.
+        '''
+        for security, securityColumns in self.columns.items():
+            for field, (rows, values) in securityColumns.items():
+                values = values[0]
+                # The ndarrays are views of the array buffers, nothing is copied
+                yield security, field, np.frombuffer(rows, dtype = np.int64), np.frombuffer(values, dtype = np.float64) if isinstance(values, array) else values
+
+    def __len__(self):
+        return len(self.datePosition)
+
+def concatColumns(parts):
+    '''
+    Concatenates column buffer dictionaries, filling columns missing from a part with None.
+    '''
+    names = list({name: None for part in parts for name in part})
+    columns = {name: [] for name in names}
+    for part in parts:
+        length = len(next(iter(part.values()), []))
+        for name in names:
+            columns[name].extend(part.get(name, [None] * length))
+    return columns
+
+def typedColumn(values, dtype):
+    '''
+    Converts a column buffer to dtype.  Integer and boolean columns holding missing values are widened to float64 and object respectively.
+    '''
+    if dtype == 'object':
+        return values
+    hasMissing = any(value is None for value in values)
+    if dtype == 'int64' and hasMissing:
+        dtype = 'float64'
+    elif dtype == 'bool' and hasMissing:
+        return values
+    return np.array(values, dtype = dtype)
+
+def checkOutputFormat(outputFormat):
+    if outputFormat not in OUTPUT_FORMATS:
+        logger.exception("Unsupported output format: {!s}".format(outputFormat))
+        raise ValueError("Unsupported output format {!r}, must be one of {!s}".format(outputFormat, OUTPUT_FORMATS))
+    return outputFormat
+
+def importArrow():
+    try:
+        import pyarrow
+    except ImportError:
+        logger.exception("pyarrow is not installed")
+        raise ImportError("pyarrow is required for the arrow and polars output formats, install it with pip install pyarrow")
+    return pyarrow
+
+def importPolars():
+    try:
+        import polars
+    except ImportError:
+        logger.exception("polars is not installed")
+        raise ImportError("polars is required for the polars output format, install it with pip install polars")
+    return polars
+
+def columnsToArrow(columns, timeZones = None):
+    '''
+    Builds a pyarrow.Table from a dictionary of column buffers.  Numeric ndarrays are handed to arrow without copying and arrow arrays are used as they are, columns named in timeZones are treated as naive UTC datetimes and typed as timezone aware timestamps.
+    '''
+    pa = importArrow()
+    timeZones = {} if timeZones is None else timeZones
+    arrays = {}
+    for column, values in columns.items():
+        if isinstance(values, pa.Array):
+            arrays[column] = values
+        elif column in timeZones:
+            arrays[column] = pa.array(np.asarray(values, dtype = 'datetime64[ns]'), type = pa.timestamp('ns', tz = timeZones[column]))
+        else:
+            arrays[column] = pa.array(values)
+    return pa.table(arrays)
+
+def columnsToOutput(columns, outputFormat, timeZones = None):
+    if outputFormat == 'arrow':
+        return columnsToArrow(columns, timeZones)
+    elif outputFormat == 'polars':
+        return importPolars().from_arrow(columnsToArrow(columns, timeZones))
+    else:
+        raise ValueError("columnsToOutput only builds arrow and polars tables, got {!r}".format(outputFormat))
+
+def outputToArrow(output):
+    '''
+    Converts a constructDf result of any output format into a pyarrow.Table.  pandas indexes, including MultiIndex columns, are kept in the table metadata so arrowToOutput can restore them.
+    '''
+    pa = importArrow()
+    if isinstance(output, pa.Table):
+        return output
+    elif hasattr(output, 'to_arrow'):
+        return output.to_arrow()
+    else:
+        return pa.Table.from_pandas(output, preserve_index = True)
+
+def arrowToOutput(table, outputFormat):
+    if outputFormat == 'arrow':
+        return table
+    elif outputFormat == 'polars':
+        return importPolars().from_arrow(table)
+    else:
+        return table.to_pandas()
@@ -0,0 +1,106 @@
+import pandas as pd
+from .BbgRefDataService import BbgRefDataService
+from .BbgDataService import BbgDataService
+from .BbgGateway import useGateway
+from . import BbgLogger
+
+logger = BbgLogger.logger
+
+class BbgOverrideSweep:
+    def __init__(self, query, overrides, maxInFlight = 8, session = None):
+        '''
+        Override sweep.  Runs one BbgDataPoint, BbgDataHistory or BbgDataService query once per override scenario, keeping up to maxInFlight requests outstanding on a single session, and combines the results into one DataFrame indexed by the override values.
+
+        Parameters
+        ----------
+        query : BbgDataPoint, BbgDataHistory or BbgDataService
+            The base query.  Its overrides, if any, apply to every scenario unless a scenario overrides the same field.
+        overrides : list of dictionaries
+            One dictionary of override field, value pairs per scenario.  Scenarios repeating an earlier one are only requested once.
+        maxInFlight : integer, default 8
+            Maximum number of requests outstanding on the session at any time.
+        session : BbgRefDataService or BbgManagedSession, optional
+            An already started session to run the sweep on instead of opening a new one.
+
+        See Also
+        --------
+        BbgOverrideSweep.constructDf : Runs the sweep and combines the results.
+
+        Examples
+        --------
+        Retrieve the curve tenor rates of a curve on several historical dates
+
+        >>> import BloombergData as bbg
+
+        >>> curve = bbg.BbgDataService(field = 'CURVE_TENOR_RATES', securities = ['YCGT0025 Index'])
+
+        >>> sweep = bbg.BbgOverrideSweep(curve, [{'CURVE_DATE': date} for date in ['20060830', '20060831', '20060901']])
+
+        >>> sweep.constructDf().head()
+            CURVE_DATE  BB_TICKER       Ask Yield   Bid Yield   Last Update     Mid Yield   Tenor   Tenor Ticker
+            20060830    YCGT0025 Index  5.041       5.051       2006-08-30      5.046       3M      912795YG Govt
+                        YCGT0025 Index  5.126       5.137       2006-08-30      5.132       6M      912795YV Govt
+        '''
+        self.query = query
+        self.overrides = [dict(scenario) for scenario in overrides]
+        if not self.overrides:
+            raise ValueError("At least one override scenario is required")
+        self.overrideNames = list({name: None for scenario in self.overrides for name in scenario})
+        self.maxInFlight = maxInFlight
+        self.sharedSession = session
+
+    def scenarioKey(self, overrides):
+        key = tuple(overrides.get(name) for name in self.overrideNames)
+        return key[0] if len(key) == 1 else key
+
+    def scenarioQuery(self, overrides):
+        # The scenario shares the base query's field cache, controller and cache but not its session or results
+        scenario = self.query.clone()
+        scenario.overrides = dict(self.query.overrides or {})
+        scenario.overrides.update(overrides)
+        return scenario
+
+    def constructDf(self):
+        '''
+        Runs every unique override scenario and returns the results concatenated with the override values as the outer index levels.  A BbgDataService query over several fields returns a dictionary of such DataFrames keyed by field.
+        '''
+        if self.query.outputFormat != 'pandas':
+            raise ValueError("Override sweeps combine pandas DataFrames, the base query must use the pandas outputFormat")
+        self.query.validateFields(bulk = True if isinstance(self.query, BbgDataService) else None)
+
+        queries = {}
+        for scenario in self.overrides:
+            key = self.scenarioKey(scenario)
+            if key not in queries:
+                queries[key] = self.scenarioQuery(scenario)
+        logger.info('Running override sweep over {} unique scenarios of {}'.format(len(queries), len(self.overrides)))
+
+        if useGateway():
+            results = {key: query.constructDf() for key, query in queries.items()}
+        else:
+            results = self.runScenarios(queries)
+        return self.combineResults(results)
+
+    def runScenarios(self, queries):
+        session = BbgRefDataService() if self.sharedSession is None else self.sharedSession
+        columns = {}
+        try:
+            for key, query in queries.items():
+                session.attachQuery(query)
+                columns[key] = query.newResponseColumns()
+            requests = ((key, query.createQueryRequest()) for key, query in queries.items())
+            # Every request is sent and read on the first scenario's connection, a BbgManagedSession gives each query its own channel
+            driver = next(iter(queries.values()))
+            for key, response, final in driver.parseResponses(requests, maxInFlight = self.maxInFlight):
+                queries[key].refDataContentToColumns(response, columns[key])
+        finally:
+            if self.sharedSession is None:
+                session.closeSession()
+        return {key: query.responseColumnsToOutput(columns[key]) for key, query in queries.items()}
+
+    def combineResults(self, results):
+        keys = list(results)
+        first = results[keys[0]]
+        if isinstance(first, dict):
+            return {field: pd.concat([results[key][field] for key in keys], keys = keys, names = self.overrideNames) for field in first}
+        return pd.concat([results[key] for key in keys], keys = keys, names = self.overrideNames)
@@ -0,0 +1,196 @@
+import collections
+import contextvars
+import cProfile
+import functools
+import inspect
+import itertools
+import json
+import os
+import random
+import time
+import tracemalloc
+from .BbgGateway import useGateway
+from . import BbgLogger
+
+logger = BbgLogger.logger
+
+DEFAULT_PROFILE_PATH = os.path.join(os.path.expanduser('~'), '.BloombergData', 'profiles')
+
+reportIds = itertools.count()
+
+# Profiler timing the current context.  Query methods decorated with timedStage only look it up and run untouched while it is unset, copies of a profiled query made during the run are timed too.
+activeProfiler = contextvars.ContextVar('activeProfiler', default = None)
+
+def timedStage(stage):
+    '''
+    Marks a query method as part of stage (validate, wait, parse, decode or build) of the BbgProfiler reports.  Time spent inside the response generators of the wait stage less the time parsing messages is time waiting on the terminal.
+    '''
+    def decorator(method):
+        if inspect.isgeneratorfunction(method):
+            @functools.wraps(method)
+            def timed(*args, **kwargs):
+                profiler = activeProfiler.get()
+                responses = method(*args, **kwargs)
+                return responses if profiler is None else timedResponses(profiler, stage, responses)
+        else:
+            @functools.wraps(method)
+            def timed(*args, **kwargs):
+                profiler = activeProfiler.get()
+                if profiler is None:
+                    return method(*args, **kwargs)
+                with BbgStageTimer(profiler, stage):
+                    return method(*args, **kwargs)
+        return timed
+    return decorator
+
+class BbgProfiler:
+    def __init__(self, query, path = DEFAULT_PROFILE_PATH, sampleRate = 1.0, traceMemory = True, profile = False):
+        '''
+        Opt-in profiler of a query's constructDf.  Records the wall and CPU time spent validating fields, waiting on the terminal, parsing response messages, decoding them into columns and building the output table, the peak memory allocated in each stage, and optionally a cProfile dump, and writes them to a JSON report per query run.
+
+        Parameters
+        ----------
+        query : BbgDataPoint, BbgDataHistory, BbgDataService, BbgIntradayBar or BbgIntradayTick
+            The query to profile.  Any object with a constructDf method can be passed, only its methods decorated with timedStage are timed per stage.
+        path : string, optional
+            Directory the reports are written to.  Defaults to ~/.BloombergData/profiles.
+        sampleRate : float, default 1.0
+            Fraction of constructDf calls profiled, the others run the query untouched.  Keeps the profiler cheap enough to leave enabled on production traffic.
+        traceMemory : bool, default True
+            Record allocation peaks with tracemalloc.  Tracing slows allocation heavy stages down noticeably.
+        profile : bool, default False
+            Also run cProfile and dump its stats next to the report, readable by pstats, snakeviz or flameprof.
+
+        Notes
+        -----
+        Queries run through a gateway are only timed as a whole.
+
+        Examples
+        --------
+        >>> import BloombergData as bbg
+
+        >>> history = bbg.BbgDataHistory(fields = ['PX_LAST'], securities = universe, startDate = '20100101', endDate = '20200101', perSelection = 'DAILY')
+
+        >>> profiled = bbg.BbgProfiler(history, sampleRate = 0.05)
+
+        >>> df = profiled.constructDf()
+
+        >>> profiled.lastReport['stages']['wait']['wall']
+            12.84
+        '''
+        self.query = query
+        self.path = path
+        self.sampleRate = sampleRate
+        self.traceMemory = traceMemory
+        self.profile = profile
+        self.lastReport = None
+
+    def constructDf(self):
+        if random.random() >= self.sampleRate:
+            return self.query.constructDf()
+        return self.profiledConstructDf()
+
+    def profiledConstructDf(self):
+        self.stages = {}
+        self.active = collections.Counter()
+        startedTracing = self.traceMemory and not tracemalloc.is_tracing()
+        if startedTracing:
+            tracemalloc.start()
+        profiler = cProfile.Profile() if self.profile else None
+        token = activeProfiler.set(self)
+
+        wallStart, cpuStart = time.perf_counter(), time.process_time()
+        error = None
+        try:
+            if profiler is not None:
+                profiler.enable()
+            self.resetPeak()
+            return self.query.constructDf()
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            wall, cpu = time.perf_counter() - wallStart, time.process_time() - cpuStart
+            peak = tracemalloc.get_traced_memory()[1] if self.traceMemory else None
+            if startedTracing:
+                tracemalloc.stop()
+            activeProfiler.reset(token)
+            self.writeReport(wall, cpu, peak, profiler, error)
+
+    def resetPeak(self):
+        if self.traceMemory and hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+    def writeReport(self, wall, cpu, peak, profiler, error):
+        stages = {name: dict(stage) for name, stage in self.stages.items()}
+        if 'wait' in stages and 'parse' in stages:
+            # Messages are parsed inside the response generators
+            stages['wait']['wall'] -= stages['parse']['wall']
+            stages['wait']['cpu'] -= stages['parse']['cpu']
+        if peak is not None:
+            # Stage timers reset the tracemalloc peak, the overall peak is the largest seen by any of them
+            peak = max([peak] + [stage.get('peakBytes', 0) for stage in stages.values()])
+        timed = sum(stage['wall'] for stage in stages.values())
+        stages['other'] = {'wall': max(wall - timed, 0.0), 'cpu': max(cpu - sum(stage['cpu'] for stage in stages.values()), 0.0), 'calls': 1}
+
+        securities = getattr(self.query, 'securities', None) or []
+        reportName = '{}-{}-{}-{}'.format(type(self.query).__name__, time.strftime('%Y%m%dT%H%M%S'), os.getpid(), next(reportIds))
+        os.makedirs(self.path, exist_ok = True)
+        report = {
+            'query': type(self.query).__name__,
+            'securities': 1 if isinstance(securities, str) else len(securities),
+            'fields': getattr(self.query, 'fields', None),
+            'gateway': useGateway(),
+            'wall': wall,
+            'cpu': cpu,
+            'peakBytes': peak,
+            'stages': stages,
+            'error': None if error is None else repr(error),
+            'profile': None
+        }
+        if profiler is not None:
+            report['profile'] = os.path.join(self.path, reportName + '.prof')
+            profiler.dump_stats(report['profile'])
+        with open(os.path.join(self.path, reportName + '.json'), 'w') as f:
+            json.dump(report, f, indent = 1, default = str)
+        self.lastReport = report
+        logger.info('Profiled {} in {:.3f}s: {}'.format(report['query'], wall, {name: round(stage['wall'], 3) for name, stage in stages.items()}))
+
+def timedResponses(profiler, stage, responses):
+    try:
+        while True:
+            with BbgStageTimer(profiler, stage):
+                try:
+                    response = next(responses)
+                except StopIteration:
+                    return
+            yield response
+    finally:
+        responses.close()
+
+class BbgStageTimer:
+    def __init__(self, profiler, stage):
+        self.profiler = profiler
+        self.name = stage
+        self.stage = profiler.stages.setdefault(stage, {'wall': 0.0, 'cpu': 0.0, 'calls': 0})
+
+    def __enter__(self):
+        # Peaks are only reset by the outermost stage so a nested stage does not hide its parent's peak
+        if not sum(self.profiler.active.values()):
+            self.profiler.resetPeak()
+        self.profiler.active[self.name] += 1
+        self.wallStart, self.cpuStart = time.perf_counter(), time.process_time()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.profiler.active[self.name] -= 1
+        # A stage method calling another of the same stage is only counted once
+        if self.profiler.active[self.name]:
+            return
+        self.stage['wall'] += time.perf_counter() - self.wallStart
+        self.stage['cpu'] += time.process_time() - self.cpuStart
+        self.stage['calls'] += 1
+        if self.profiler.traceMemory:
+            self.stage['peakBytes'] = max(self.stage.get('peakBytes', 0), tracemalloc.get_traced_memory()[1])
@@ -0,0 +1,175 @@
+import datetime as dt
+import pandas as pd
+from .BbgRefDataService import BbgRefDataService
+from .BbgDataPoint import BbgDataPoint
+from .BbgDataHistory import BbgDataHistory
+from .BbgGateway import useGateway
+from . import BbgLogger
+
+logger = BbgLogger.logger
+
+class BbgQueryPlan:
+    def __init__(self, queries):
+        '''
+        Cross-query planner.  Takes a batch of query objects, merges the ones that can share a Bloomberg request and splits the merged results back into the DataFrame each original query's constructDf would have returned.
+
+        Parameters
+        ----------
+        queries : list
+            Query objects to run.  BbgDataPoint queries sharing the same overrides are merged into one ReferenceDataRequest.  BbgDataHistory queries sharing the same overrides and periodicity are merged into one HistoricalDataRequest when their date ranges overlap.  ACTUAL periodicity other than DAILY samples dates back from the end date, so those queries are only merged when their date ranges are identical.  Only queries sharing the same session, fieldCache, controller and cache are merged.  Queries of any other class, with a non pandas outputFormat or with nothing to merge with are run unchanged.
+
+        Notes
+        -----
+        A merged request covers every security and field of the queries merged into it, so the plan trades some extra data points for fewer requests.
+
+        See Also
+        --------
+        BbgQueryPlan.run : Runs the merged requests and returns one result per original query.
+        BbgQueryPlan.describe : Lists the merged requests and the queries each of them serves.
+
+        Examples
+        --------
+        >>> import BloombergData as bbg
+
+        >>> plan = bbg.BbgQueryPlan([bbg.BbgDataPoint(securities = ['MSFT US Equity'], fields = ['PX_LAST']),
+                                     bbg.BbgDataPoint(securities = ['IBM US Equity'], fields = ['PX_LAST', 'PX_BID'])])
+
+        >>> plan.requestsBefore, plan.requestsAfter
+            (2, 1)
+
+        >>> msft, ibm = plan.run()
+        '''
+        self.queries = list(queries)
+        self.plan()
+
+    def plan(self):
+        self.mergedQueries = []
+        pointGroups = {}
+        historyGroups = {}
+        for i, query in enumerate(self.queries):
+            if getattr(query, 'outputFormat', 'pandas') != 'pandas':
+                self.mergedQueries.append((query, [i]))
+            elif type(query) is BbgDataPoint:
+                pointGroups.setdefault((self.overridesKey(query.overrides), self.attachmentsKey(query)), []).append(i)
+            elif type(query) is BbgDataHistory:
+                historyGroups.setdefault((query.perAdjustment, query.perSelection, self.overridesKey(query.overrides), self.attachmentsKey(query)), []).append(i)
+            else:
+                self.mergedQueries.append((query, [i]))
+
+        for members in pointGroups.values():
+            if len(members) == 1:
+                self.mergedQueries.append((self.queries[members[0]], members))
+                continue
+            first = self.queries[members[0]]
+            merged = BbgDataPoint(fields = self.union(self.queries[i].fields for i in members), securities = self.union(self.queries[i].securities for i in members), overrides = first.overrides,
+                                  session = first.sharedSession, fieldCache = first.fieldCache, controller = first.controller, cache = first.cache)
+            self.mergedQueries.append((merged, members))
+
+        for (perAdjustment, perSelection, _, _), members in historyGroups.items():
+            for cluster in self.clusterDateRanges(members, mergeOverlapping = perSelection == 'DAILY' or perAdjustment != 'ACTUAL'):
+                first = self.queries[cluster[0]]
+                if len(cluster) == 1:
+                    self.mergedQueries.append((first, cluster))
+                    continue
+                merged = BbgDataHistory(fields = self.union(self.queries[i].fields for i in cluster), securities = self.union(self.queries[i].securities for i in cluster),
+                                        startDate = min(self.queries[i].startDate for i in cluster), endDate = max(self.queries[i].endDate for i in cluster),
+                                        perAdjustment = perAdjustment, perSelection = perSelection, overrides = first.overrides,
+                                        session = first.sharedSession, fieldCache = first.fieldCache, controller = first.controller)
+                self.mergedQueries.append((merged, cluster))
+
+        logger.info('Planned {} queries into {} requests'.format(self.requestsBefore, self.requestsAfter))
+        return self.mergedQueries
+
+    def clusterDateRanges(self, members, mergeOverlapping):
+        # Dates are YYYYMMDD strings so they sort chronologically
+        members = sorted(members, key = lambda i: (self.queries[i].startDate, self.queries[i].endDate))
+        clusters = []
+        clusterEnd = None
+        for i in members:
+            query = self.queries[i]
+            if clusters and mergeOverlapping and query.startDate <= clusterEnd:
+                clusters[-1].append(i)
+                clusterEnd = max(clusterEnd, query.endDate)
+            elif clusters and not mergeOverlapping and (query.startDate, query.endDate) == (self.queries[clusters[-1][0]].startDate, self.queries[clusters[-1][0]].endDate):
+                clusters[-1].append(i)
+            else:
+                clusters.append([i])
+                clusterEnd = query.endDate
+        return clusters
+
+    def attachmentsKey(self, query):
+        # Only queries sharing the same session, field cache, controller and shared cache are merged, the merged query is given them
+        return tuple(id(getattr(query, name, None)) for name in ['sharedSession', 'fieldCache', 'controller', 'cache'])
+
+    def overridesKey(self, overrides):
+        return () if overrides is None else tuple(sorted(overrides.items()))
+
+    def union(self, lists):
+        items = {}
+        for values in lists:
+            for value in ([values] if isinstance(values, str) else values):
+                items[value] = None
+        return list(items)
+
+    @property
+    def requestsBefore(self):
+        return sum(self.requestCount(query) for query in self.queries)
+
+    @property
+    def requestsAfter(self):
+        return sum(self.requestCount(query) for query, _ in self.mergedQueries)
+
+    def requestCount(self, query):
+        # The intraday classes send one request per security
+        if hasattr(query, 'startTime'):
+            return len(query.securities)
+        return 1
+
+    def describe(self):
+        '''
+        Returns a DataFrame with one row per planned request listing its type, size and the positions of the original queries it serves.
+        '''
+        return pd.DataFrame([{
+            'Request': type(query).__name__,
+            'Securities': len(self.union([query.securities])),
+            'Fields': len(self.union([query.fields])) if hasattr(query, 'fields') else None,
+            'StartDate': getattr(query, 'startDate', None),
+            'EndDate': getattr(query, 'endDate', None),
+            'Requests': self.requestCount(query),
+            'Queries': members
+        } for query, members in self.mergedQueries])
+
+    def run(self, session = None):
+        '''
+        Runs the planned requests and returns a list with the result of each original query, in the order the queries were passed.  Queries passed with their own session run on it, all others run on session or, unless one is passed, on one session opened for the plan.  The sessions of the queries are left as they were passed.
+        '''
+        ownSession = session is None and not useGateway()
+        if ownSession:
+            session = BbgRefDataService()
+        results = [None] * len(self.queries)
+        previousSessions = [query.sharedSession for query, _ in self.mergedQueries]
+        try:
+            for query, members in self.mergedQueries:
+                if session is not None and query.sharedSession is None:
+                    query.sharedSession = session
+                output = query.constructDf()
+                for i in members:
+                    results[i] = output if query is self.queries[i] else self.splitResult(self.queries[i], output)
+        finally:
+            for (query, _), previousSession in zip(self.mergedQueries, previousSessions):
+                query.sharedSession = previousSession
+            if ownSession:
+                session.closeSession()
+        return results
+
+    def splitResult(self, query, output):
+        securities = sorted(set(self.union([query.securities])))
+        fields = sorted(set(self.union([query.fields])))
+        if type(query) is BbgDataPoint:
+            return output.reindex(index = [security for security in securities if security in output.index], columns = [field for field in fields if field in output.columns])
+
+        startDate = dt.datetime.strptime(query.startDate, '%Y%m%d').date()
+        endDate = dt.datetime.strptime(query.endDate, '%Y%m%d').date()
+        rows = [startDate <= date <= endDate for date in output.index]
+        columns = [(security, field) for field in fields for security in securities if (security, field) in output.columns]
+        return output.loc[rows, columns].dropna(how = 'all')
@@ -1,8 +1,13 @@
 import blpapi
-from .BbgSession import BbgSession
+import copy
+import datetime as dt
+import itertools
+import time
+from .BbgSession import BbgSession, SESSION_DOWN
 import pandas as pd
 import numpy as np
 from . import BbgLogger
+from .BbgProfiler import timedStage
 
 SECURITY_DATA = blpapi.Name("securityData")
 SECURITY = blpapi.Name("security")
@@ -15,13 +20,34 @@ logger = BbgLogger.logger
 
 class BbgRefDataService(BbgSession):
 
-    def __init__(self):
-        BbgSession.__init__(self)
-        self.startSession()
-        self.service = self.openService(serviceUrl = "//blp/refdata")
+    def __init__(self, session = None, serviceUrl = "//blp/refdata"):
+        if session is None:
+            BbgSession.__init__(self)
+            self.startSession()
+            self.service = self.openService(serviceUrl = serviceUrl)
+            self.ownsSession = True
+        else:
+            # Queries run on a shared session must leave it open for the next query
+            session.attachQuery(self)
+            self.ownsSession = False
         self.request = None
         self.bbgRefData = None
+
+    def attachQuery(self, query):
+        query.session = self.session
+        query.timeout = self.timeout
+        query.service = self.service
     
+    @timedStage('validate')
+    def validateFields(self, bulk = None):
+        if self.fieldCache is not None:
+            self.fieldCache.validateFields(self.fields, bulk = bulk)
+
+    def fieldDtypes(self):
+        if self.fieldCache is None:
+            return {}
+        return {field.upper(): dtype for field, dtype in self.fieldCache.dtypes(self.fields).items()}
+
     def createRequest(self, requestType, securities, fields):
 
         logger.info("Creating refdata request...")
@@ -56,7 +82,7 @@ class BbgRefDataService(BbgSession):
             request.set("gapFillInitialBar", True)
         return request
 
-    def createIntradayRequest(self, requestType, security, fields, startTime, endTime):
+    def createIntradayRequest(self, requestType, security, fields, startTime, endTime, includeConditionCodes = True):
         logger.info("Creating refdata intraday request...")
         request = self.service.createRequest(requestType)
         request.set("security", security)
@@ -64,7 +90,7 @@ class BbgRefDataService(BbgSession):
         request.set("endDateTime", endTime)
         for field in fields:
             request.getElement("eventTypes").appendValue(field)
-        request.set("includeConditionCodes", True)
+        request.set("includeConditionCodes", includeConditionCodes)
         return request
 
     def appendRequestOverrides(self, request, overrides):
@@ -77,23 +103,143 @@ class BbgRefDataService(BbgSession):
                 overrideList[len(overrideList) - 1].setElement("value", v)
         return request
 
+    @timedStage('wait')
     def parseResponse(self, cid, stopSession = True):
+        done = False
         try:
-            while(True):
+            while(not done):
                 ev = self.session.nextEvent(500)
 
                 for msg in ev:
                     if cid in msg.correlationIds() and ev.eventType() in [blpapi.Event.RESPONSE, blpapi.Event.PARTIAL_RESPONSE]:
                         logger.info(msg)
+                        # Only the final response to this request ends it, a RESPONSE left on a shared session by an earlier request does not
+                        done = ev.eventType() == blpapi.Event.RESPONSE
                         yield(self.parseResponseMsg(msg))
-                    
-                if ev.eventType() == blpapi.Event.RESPONSE:
-                    break
+                    elif cid in msg.correlationIds() and ev.eventType() == blpapi.Event.REQUEST_STATUS:
+                        logger.exception('Request failed: {}'.format(msg))
+                        raise RuntimeError('Request failed: {}'.format(msg))
+                    elif ev.eventType() == blpapi.Event.SESSION_STATUS and str(msg.messageType()) in SESSION_DOWN:
+                        # No RESPONSE ever arrives for a request on a dropped session
+                        logger.exception('Session lost while waiting for a response: {}'.format(msg))
+                        raise ConnectionError('Session lost while waiting for a response: {}'.format(msg.messageType()))
         finally:
             # Stop the session
-            if stopSession == True:
+            if stopSession == True and self.ownsSession:
                 self.closeSession()
+            elif not done:
+                # A request abandoned on a session left open is cancelled so its responses are not read by the next query
+                self.cancelRequests([cid])
+
+    def cancelRequests(self, cids):
+        for cid in cids:
+            try:
+                self.session.cancel(cid)
+            except Exception as e:
+                logger.info('Failed to cancel request {!s}: {!s}'.format(cid, e))
     
+    @timedStage('wait')
+    def parseResponses(self, requests, maxInFlight = 8, controller = None, requestType = None, rowCount = None):
+        '''
+        Sends (key, request) pairs on this session keeping at most maxInFlight requests outstanding, and yields (key, response, final) for every response message as it arrives, final being True for the last message of a request.  The session is left open.
+
+        When a BbgAdaptiveController is passed the number of requests in flight is taken from it, and the latency, PARTIAL_RESPONSE count and rows (counted by rowCount on each response) of every request of requestType are recorded in it.  requests is only advanced as requests are sent, so a generator sizing requests from the controller picks up the latest sizes.
+        '''
+        requests = iter(requests)
+        inFlight = {}
+        stats = {}
+
+        def limit():
+            return maxInFlight if controller is None else controller.size(requestType, 'inFlight')
+
+        def sendNext():
+            for key, request in itertools.islice(requests, 1):
+                sent = time.perf_counter()
+                # Correlation ids are generated by the session so they never collide with those of other requests sharing it
+                cid = self.session.sendRequest(request)
+                inFlight[cid] = key
+                stats[cid] = {'sent': sent, 'partials': 0, 'rows': 0}
+                return True
+            return False
+
+        def record(cid, failed = False):
+            requestStats = stats.pop(cid)
+            if controller is not None:
+                controller.record(requestType, time.perf_counter() - requestStats['sent'], requestStats['partials'], requestStats['rows'], failed = failed)
+
+        try:
+            while len(inFlight) < limit() and sendNext():
+                pass
+
+            while inFlight:
+                ev = self.session.nextEvent(500)
+                for msg in ev:
+                    for cid in msg.correlationIds():
+                        if cid not in inFlight:
+                            continue
+                        if ev.eventType() in [blpapi.Event.RESPONSE, blpapi.Event.PARTIAL_RESPONSE]:
+                            logger.info(msg)
+                            final = ev.eventType() == blpapi.Event.RESPONSE
+                            key = inFlight.pop(cid) if final else inFlight[cid]
+                            response = self.parseResponseMsg(msg)
+                            stats[cid]['rows'] += 0 if rowCount is None else rowCount(response)
+                            if final:
+                                record(cid)
+                            else:
+                                stats[cid]['partials'] += 1
+                            yield (key, response, final)
+                            if final:
+                                while len(inFlight) < limit() and sendNext():
+                                    pass
+                        elif ev.eventType() == blpapi.Event.REQUEST_STATUS:
+                            record(cid, failed = True)
+                            logger.exception('Request {!r} failed: {}'.format(inFlight[cid], msg))
+                            raise RuntimeError('Request {!r} failed: {}'.format(inFlight[cid], msg))
+                    if ev.eventType() == blpapi.Event.SESSION_STATUS and str(msg.messageType()) in SESSION_DOWN:
+                        logger.exception('Session lost with {} requests in flight: {}'.format(len(inFlight), msg))
+                        raise ConnectionError('Session lost with {} requests in flight: {}'.format(len(inFlight), msg.messageType()))
+        finally:
+            # Requests still outstanding after an error or an abandoned iteration would otherwise answer into the next query's events
+            self.cancelRequests(list(inFlight))
+            if controller is not None:
+                controller.save()
+
+    @timedStage('wait')
+    def parseControlledResponses(self, requests, requestType, rowCount):
+        '''
+        Runs requests sized by this query's controller through parseResponses, stopping the session once they complete if the query owns it.
+        '''
+        try:
+            for key, response, final in self.parseResponses(requests, controller = self.controller, requestType = requestType, rowCount = rowCount):
+                yield key, response, final
+        finally:
+            if self.ownsSession:
+                self.closeSession()
+
+    def securityChunks(self, requestType):
+        '''
+        Yields successive chunks of the query's securities, each sized by the controller's current securities per request.
+        '''
+        securities = [self.securities] if isinstance(self.securities, str) else list(self.securities)
+        i = 0
+        while i < len(securities):
+            size = self.controller.size(requestType, 'securities')
+            yield securities[i:i + size]
+            i += size
+
+    def timeWindows(self, requestType, step = 1):
+        '''
+        Yields (security, start, end) windows covering startTime to endTime for every security, each window as long as the controller's current window rounded down to a multiple of step seconds.
+        '''
+        for security in self.securities:
+            start = self.startTime
+            while start < self.endTime:
+                seconds = max(self.controller.size(requestType, 'window') // step, 1) * step
+                end = min(start + dt.timedelta(seconds = seconds), self.endTime)
+                yield security, start, end
+                start = end
+
+    @timedStage('parse')
     def parseResponseMsg(self, msg):
         return {
             "messageType" : "{}".format(msg.messageType()),
@@ -124,8 +270,33 @@ class BbgRefDataService(BbgSession):
             finally:
                 return returnValue
     
+    def clone(self):
+        '''
+        Returns a copy of the query's parameters sharing its field cache, adaptive controller and shared cache, but not its session or results.
+        '''
+        # Copying goes through __getstate__, which leaves out everything bound to this process, the attachments are shared back explicitly
+        query = copy.copy(self)
+        for attr in ['fieldCache', 'controller', 'cache']:
+            setattr(query, attr, getattr(self, attr, None))
+        return query
+
+    def __getstate__(self):
+        # Only the query parameters are pickled, the blpapi session and results stay in the process that owns them
+        state = self.__dict__.copy()
+        for attr in ['session', 'service', 'timeout', 'request', 'cid', 'bbgRefData', 'sharedSession', 'ownsSession', 'fieldCache', 'controller', 'cache']:
+            state.pop(attr, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.sharedSession = None
+        self.fieldCache = None
+        self.controller = None
+        self.cache = None
+
     def __del__(self):
-        self.closeSession()
+        if getattr(self, 'ownsSession', False):
+            self.closeSession()
         
  # partial lookup table for events used from blpapi.Event
 eDict = {
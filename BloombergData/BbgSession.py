@@ -1,8 +1,15 @@
 import blpapi
+import collections
+import itertools
+import queue
+import threading
+import time
 from . import BbgLogger
 
 logger = BbgLogger.logger
 
+SESSION_DOWN = ['SessionConnectionDown', 'SessionTerminated', 'SessionStartupFailure']
+
 class BbgSession:
     def __init__(self, host='localhost', port=8194, session = None, timeout = 500):
         sessionOptions = blpapi.SessionOptions()
@@ -65,6 +72,324 @@ class BbgSession:
     def __del__(self):
         self.closeSession()
     
+class BbgManagedSession(BbgSession):
+    def __init__(self, host = 'localhost', port = 8194, services = ("//blp/refdata",), timeout = 500, readyTimeout = 30.0, backoff = 1.0, maxBackoff = 60.0):
+        '''
+        Long running, self healing Bloomberg session.  start connects and opens services in the background so the first query does not wait on them.  SESSION_STATUS and SERVICE_STATUS events are watched and a dropped connection is re-established with exponential backoff.  Requests in flight when the connection drops are resubmitted once it is back if none of their response had been received yet, otherwise they fail with a ConnectionError.
+
+        Queries share the session by passing it as their session argument, each query is given its own channel so their responses never mix.
+
+        Parameters
+        ----------
+        host : string, default localhost
+        port : integer, default 8194
+        services : tuple, default ("//blp/refdata",)
+            Services opened on every connection.  Queries are attached to the first one.
+        timeout : integer, default 500
+            Milliseconds waited on each event poll.
+        readyTimeout : float, default 30.0
+            Seconds a request waits for the session to be connected with its services open before failing with a ConnectionError.  Covers the initial background connect and reconnections.
+        backoff : float, default 1.0
+            Seconds waited before the first reconnection attempt, doubled on every failed attempt up to maxBackoff.
+        maxBackoff : float, default 60.0
+
+        Notes
+        -----
+        Resubmitting a request rebuilds it on the new connection from Request.toPy, which requires blpapi 3.18 or later.  With older versions requests in flight always fail on a dropped connection.
+
+        See Also
+        --------
+        BbgManagedSession.waitReady : Blocks until the session is connected and its services opened.
+        BbgManagedSession.metrics : Connection state and counters.
+
+        Examples
+        --------
+        >>> import BloombergData as bbg
+
+        >>> session = bbg.BbgManagedSession().start()
+
+        >>> session.waitReady(30)
+            True
+
+        >>> bbg.BbgDataPoint(fields = ['PX_LAST'], securities = ['IBM US Equity'], session = session).constructDf()
+        '''
+        self.host = host
+        self.port = port
+        self.serviceUrls = list(services)
+        self.timeout = timeout
+        self.readyTimeout = readyTimeout
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.session = None
+        self.services = {}
+        self.state = 'stopped'
+        self.ready = threading.Event()
+        self.lock = threading.RLock()
+        self.closed = False
+        self.attempts = 0
+        self.correlationIds = itertools.count()
+        # Requests sent on the current connection keyed by their correlation id, and requests waiting to be resubmitted
+        self.inFlight = {}
+        self.pending = []
+        self.counters = collections.Counter()
+        self.connectedAt = None
+
+    def start(self):
+        '''
+        Starts connecting in the background and returns the session straight away.
+        '''
+        with self.lock:
+            self.closed = False
+            if self.session is None:
+                self.connect()
+        return self
+
+    def connect(self):
+        sessionOptions = blpapi.SessionOptions()
+        sessionOptions.setServerHost(self.host)
+        sessionOptions.setServerPort(self.port)
+        logger.info('Managed session connecting to {!s}:{!s}'.format(self.host, self.port))
+        self.state = 'connecting'
+        self.counters['connectAttempts'] += 1
+        self.services = {}
+        self.session = blpapi.Session(sessionOptions, self.processEvent)
+        if not self.session.startAsync():
+            self.session = None
+            self.scheduleReconnect()
+
+    def scheduleReconnect(self):
+        if self.closed:
+            return
+        delay = min(self.backoff * 2 ** self.attempts, self.maxBackoff)
+        self.attempts += 1
+        self.state = 'reconnecting'
+        logger.info('Managed session reconnecting in {:.1f}s'.format(delay))
+        timer = threading.Timer(delay, self.reconnect)
+        timer.daemon = True
+        timer.start()
+
+    def reconnect(self):
+        with self.lock:
+            if not self.closed and self.session is None:
+                self.connect()
+
+    def processEvent(self, event, session):
+        eventType = event.eventType()
+        if eventType == blpapi.Event.SESSION_STATUS or eventType == blpapi.Event.SERVICE_STATUS:
+            for msg in event:
+                self.processStatus(str(msg.messageType()), msg, session)
+        elif eventType in [blpapi.Event.RESPONSE, blpapi.Event.PARTIAL_RESPONSE, blpapi.Event.REQUEST_STATUS]:
+            for msg in event:
+                for cid in msg.correlationIds():
+                    self.routeMessage(eventType, msg, cid)
+
+    def processStatus(self, msgType, msg, session):
+        with self.lock:
+            # Events still arriving from a connection already given up on are ignored
+            if session is not self.session:
+                return
+            logger.info('Managed session status {}'.format(msgType))
+            if msgType == 'SessionStarted':
+                for serviceUrl in self.serviceUrls:
+                    session.openServiceAsync(serviceUrl)
+            elif msgType == 'ServiceOpened':
+                serviceUrl = msg.getElementAsString("serviceName")
+                self.services[serviceUrl] = session.getService(serviceUrl)
+                if len(self.services) == len(self.serviceUrls):
+                    self.connected()
+            elif msgType == 'ServiceOpenFailure':
+                logger.exception('Managed session failed to open a service: {}'.format(msg))
+                self.dropped()
+            elif msgType in SESSION_DOWN:
+                self.dropped()
+
+    def connected(self):
+        self.state = 'ready'
+        self.attempts = 0
+        self.connectedAt = time.time()
+        self.counters['connects'] += 1
+        pending, self.pending = self.pending, []
+        for entry in pending:
+            try:
+                self.resubmit(entry)
+            except Exception as e:
+                logger.exception('Failed to resubmit request: {!s}'.format(e))
+                self.fail(entry)
+        self.ready.set()
+
+    def dropped(self):
+        self.ready.clear()
+        self.counters['disconnects'] += 1
+        self.connectedAt = None
+        session, self.session = self.session, None
+        try:
+            session.stopAsync()
+        except Exception as e:
+            logger.info('Failed to stop dropped session cleanly: {!s}'.format(e))
+        for entry in self.inFlight.values():
+            if entry['partial'] or not hasattr(entry['request'], 'toPy'):
+                self.fail(entry)
+            else:
+                entry['data'] = entry['request'].toPy()
+                self.pending.append(entry)
+        self.inFlight = {}
+        self.scheduleReconnect()
+
+    def fail(self, entry):
+        self.counters['failedRequests'] += 1
+        entry['channel'].events.put(BbgChannelEvent(blpapi.Event.SESSION_STATUS, [BbgChannelMessage('SessionConnectionDown', [entry['cid']])]))
+
+    def resubmit(self, entry):
+        request = self.services[entry['serviceUrl']].createRequest(str(entry['request'].asElement().name()))
+        request.fromPy(entry['data'])
+        entry['request'] = request
+        self.counters['resubmittedRequests'] += 1
+        self.send(entry)
+
+    def send(self, entry):
+        internalCid = blpapi.CorrelationId(next(self.correlationIds))
+        self.inFlight[internalCid] = entry
+        self.session.sendRequest(entry['request'], correlationId = internalCid)
+
+    def routeMessage(self, eventType, msg, cid):
+        with self.lock:
+            entry = self.inFlight.get(cid)
+            if entry is None:
+                return
+            if eventType == blpapi.Event.PARTIAL_RESPONSE:
+                entry['partial'] = True
+            else:
+                self.inFlight.pop(cid)
+                self.counters['failedRequests' if eventType == blpapi.Event.REQUEST_STATUS else 'completedRequests'] += 1
+        entry['channel'].events.put(BbgChannelEvent(eventType, [BbgRoutedMessage(msg, entry['cid'])]))
+
+    def sendRequest(self, channel, request, correlationId = None):
+        if not self.waitReady(self.readyTimeout):
+            raise ConnectionError('Managed session is not connected ({})'.format(self.state))
+        cid = blpapi.CorrelationId(next(self.correlationIds)) if correlationId is None else correlationId
+        with self.lock:
+            if self.session is None:
+                raise ConnectionError('Managed session is not connected ({})'.format(self.state))
+            self.counters['sentRequests'] += 1
+            self.send({'channel': channel, 'request': request, 'cid': cid, 'serviceUrl': channel.serviceUrl, 'partial': False})
+        return cid
+
+    def cancel(self, channel, cid):
+        with self.lock:
+            for internalCid, entry in list(self.inFlight.items()):
+                if entry['channel'] is channel and entry['cid'] == cid:
+                    self.inFlight.pop(internalCid)
+                    if self.session is not None:
+                        self.session.cancel(internalCid)
+            self.pending = [entry for entry in self.pending if not (entry['channel'] is channel and entry['cid'] == cid)]
+
+    def waitReady(self, timeout = None):
+        '''
+        Blocks until the session is connected with every service open, or timeout seconds have passed.  Returns whether the session is ready.
+        '''
+        return self.ready.wait(timeout)
+
+    def channel(self, serviceUrl = None):
+        return BbgSessionChannel(self, self.serviceUrls[0] if serviceUrl is None else serviceUrl)
+
+    def attachQuery(self, query):
+        query.session = self.channel()
+        query.timeout = self.timeout
+        query.service = BbgServiceProxy(self, query.session.serviceUrl)
+
+    def metrics(self):
+        '''
+        Returns the connection state, uptime of the current connection in seconds, requests in flight and waiting to be resubmitted, and the connection and request counters.
+        '''
+        with self.lock:
+            metrics = {
+                'state': self.state,
+                'ready': self.ready.is_set(),
+                'uptime': None if self.connectedAt is None else time.time() - self.connectedAt,
+                'inFlight': len(self.inFlight),
+                'pending': len(self.pending)
+            }
+            metrics.update(self.counters)
+        return metrics
+
+    def closeSession(self):
+        with self.lock:
+            self.closed = True
+            self.ready.clear()
+            self.state = 'stopped'
+            session, self.session = self.session, None
+        if session is not None:
+            session.stop()
+
+class BbgSessionChannel:
+    def __init__(self, managedSession, serviceUrl):
+        '''
+        One query's view of a BbgManagedSession, offering the sendRequest, cancel and nextEvent calls of a blpapi Session over the responses to its own requests only.
+        '''
+        self.managedSession = managedSession
+        self.serviceUrl = serviceUrl
+        self.events = queue.Queue()
+
+    def sendRequest(self, request, correlationId = None):
+        return self.managedSession.sendRequest(self, request, correlationId)
+
+    def cancel(self, correlationId):
+        self.managedSession.cancel(self, correlationId)
+
+    def nextEvent(self, timeout = 0):
+        try:
+            return self.events.get(timeout = timeout / 1000 if timeout else None)
+        except queue.Empty:
+            return BbgChannelEvent(blpapi.Event.TIMEOUT, [])
+
+class BbgServiceProxy:
+    def __init__(self, managedSession, serviceUrl):
+        # Requests are always created on the service of the current connection
+        self.managedSession = managedSession
+        self.serviceUrl = serviceUrl
+
+    def createRequest(self, requestType):
+        if not self.managedSession.waitReady(self.managedSession.readyTimeout):
+            raise ConnectionError('Managed session is not connected ({})'.format(self.managedSession.state))
+        return self.managedSession.services[self.serviceUrl].createRequest(requestType)
+
+class BbgChannelEvent:
+    def __init__(self, eventType, messages):
+        self.type = eventType
+        self.messages = messages
+
+    def eventType(self):
+        return self.type
+
+    def __iter__(self):
+        return iter(self.messages)
+
+class BbgRoutedMessage:
+    def __init__(self, msg, cid):
+        # Reports the correlation id the query sent the request with rather than the one it was last sent on
+        self.msg = msg
+        self.cid = cid
+
+    def correlationIds(self):
+        return [self.cid]
+
+    def __getattr__(self, name):
+        return getattr(self.msg, name)
+
+    def __str__(self):
+        return str(self.msg)
+
+class BbgChannelMessage:
+    def __init__(self, msgType, correlationIds):
+        self.msgType = msgType
+        self.cids = correlationIds
+
+    def messageType(self):
+        return self.msgType
+
+    def correlationIds(self):
+        return self.cids
+
 # partial lookup table for events used from blpapi.Event
 eDict = {
     blpapi.Event.SESSION_STATUS: 'SESSION_STATUS',
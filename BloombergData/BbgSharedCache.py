@@ -0,0 +1,253 @@
+import argparse
+import json
+import multiprocessing
+import os
+import pickle
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from . import BbgLogger
+
+logger = BbgLogger.logger
+
+DEFAULT_SHARED_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.BloombergData', 'refDataCache.sqlite')
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS refData (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)"
+]
+
+# SQLite limits the number of bound parameters of a statement
+BATCH_SIZE = 500
+
+class BbgSharedCache:
+    def __init__(self, path = DEFAULT_SHARED_CACHE_PATH, ttl = 86400, fieldTtls = None, leaseTimeout = 60, pollInterval = 0.05, compressLevel = 1):
+        '''
+        Reference data cache shared by every process on a host.  Values are kept in a WAL mode SQLite database, pickled and zlib compressed, and expire after a TTL set per field.  Refreshing expired keys is protected by leases so when several workers miss the same keys only one of them requests them while the others wait for its result.
+
+        Parameters
+        ----------
+        path : string, optional
+            Location of the SQLite database, created if it does not exist.  Defaults to ~/.BloombergData/refDataCache.sqlite.  Must be on a local filesystem, WAL mode does not work over network filesystems.
+        ttl : float, default 86400
+            Seconds a value stays valid when its field has no TTL in fieldTtls.
+        fieldTtls : dictionary, optional
+            Field name, TTL in seconds pairs overriding ttl.
+        leaseTimeout : float, default 60
+            Seconds after which a refresh lease held by a worker that died or hung is taken over by another.
+        pollInterval : float, default 0.05
+            Seconds between checks for keys being refreshed by another worker.
+        compressLevel : integer, default 1
+            zlib compression level of the stored values.
+
+        Notes
+        -----
+        A cache can be passed to worker processes, each opens its own database connections.
+
+        See Also
+        --------
+        BbgDataPoint : Reads and fills the cache per (security, field) when passed one.
+        BbgDataService : Reads and fills the cache per (security, bulk field) when passed one.
+        benchmark : Measures read throughput under concurrent reader processes.
+
+        Examples
+        --------
+        >>> import BloombergData as bbg
+
+        >>> cache = bbg.BbgSharedCache(fieldTtls = {'PX_LAST': 300})
+
+        >>> bbg.BbgDataPoint(fields = ['PX_LAST', 'NAME'], securities = ['IBM US Equity'], cache = cache).constructDf()
+        '''
+        self.path = path
+        self.ttl = ttl
+        self.fieldTtls = dict(fieldTtls or {})
+        self.leaseTimeout = leaseTimeout
+        self.pollInterval = pollInterval
+        self.compressLevel = compressLevel
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok = True)
+        connection = self.connection()
+        for statement in SCHEMA:
+            connection.execute(statement)
+
+    def connection(self):
+        # sqlite3 connections may not be shared across threads or forked processes
+        if getattr(self.local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout = 30, isolation_level = None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+            self.local.owner = '{}:{}:{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex)
+        return self.local.connection
+
+    def owner(self):
+        self.connection()
+        return self.local.owner
+
+    def fieldTtl(self, field):
+        return self.fieldTtls.get(field, self.ttl)
+
+    def dumps(self, value):
+        return zlib.compress(pickle.dumps(value, protocol = pickle.HIGHEST_PROTOCOL), self.compressLevel)
+
+    def loads(self, blob):
+        return pickle.loads(zlib.decompress(blob))
+
+    def getMany(self, keys):
+        '''
+        Returns a dictionary of the unexpired values of keys, keys missing or expired are left out.
+        '''
+        keys = list(keys)
+        values = {}
+        now = time.time()
+        connection = self.connection()
+        for i in range(0, len(keys), BATCH_SIZE):
+            batch = keys[i:i + BATCH_SIZE]
+            rows = connection.execute("SELECT key, value FROM refData WHERE expires > ? AND key IN ({})".format(','.join('?' * len(batch))), [now] + batch)
+            for key, blob in rows:
+                values[key] = self.loads(blob)
+        return values
+
+    def get(self, key, default = None):
+        return self.getMany([key]).get(key, default)
+
+    def putMany(self, items):
+        '''
+        Stores (key, (value, ttl)) pairs in a single transaction.
+        '''
+        now = time.time()
+        rows = [(key, self.dumps(value), now + ttl) for key, (value, ttl) in items.items()]
+        connection = self.connection()
+        with self.transaction(connection):
+            connection.executemany("INSERT OR REPLACE INTO refData (key, value, expires) VALUES (?, ?, ?)", rows)
+
+    def put(self, key, value, ttl = None):
+        self.putMany({key: (value, self.ttl if ttl is None else ttl)})
+
+    def transaction(self, connection):
+        return BbgImmediateTransaction(connection)
+
+    def acquireLeases(self, keys):
+        '''
+        Takes the refresh lease of every key not leased by another live worker and returns the keys leased.  Keys stored by another worker since they were found missing are not leased, so a worker never refreshes keys a previous leaseholder has just filled.
+        '''
+        now = time.time()
+        owner = self.owner()
+        connection = self.connection()
+        acquired = []
+        with self.transaction(connection):
+            for key in keys:
+                if connection.execute("SELECT 1 FROM refData WHERE key = ? AND expires > ?", (key, now)).fetchone() is not None:
+                    continue
+                row = connection.execute("SELECT owner, expires FROM leases WHERE key = ?", (key,)).fetchone()
+                if row is None or row[1] <= now or row[0] == owner:
+                    connection.execute("INSERT OR REPLACE INTO leases (key, owner, expires) VALUES (?, ?, ?)", (key, owner, now + self.leaseTimeout))
+                    acquired.append(key)
+        return acquired
+
+    def releaseLeases(self, keys):
+        connection = self.connection()
+        with self.transaction(connection):
+            connection.executemany("DELETE FROM leases WHERE key = ? AND owner = ?", [(key, self.owner()) for key in keys])
+
+    def fetch(self, keys, fetcher, ttlFor = None):
+        '''
+        Returns a dictionary of the values of keys, calling fetcher with the list of keys missing from the cache and storing the dictionary it returns.  Keys missing here but being refreshed by another worker are waited on rather than fetched again.  Keys the fetcher does not return are left out of the result.
+        '''
+        keys = list(dict.fromkeys(keys))
+        values = self.getMany(keys)
+        missing = [key for key in keys if key not in values]
+        if missing:
+            logger.info('Shared cache hit {} of {} keys'.format(len(keys) - len(missing), len(keys)))
+        while missing:
+            leased = self.acquireLeases(missing)
+            if leased:
+                try:
+                    fetched = fetcher(leased)
+                    stored = {key: fetched[key] for key in leased if key in fetched}
+                    self.putMany({key: (value, self.ttl if ttlFor is None else ttlFor(key)) for key, value in stored.items()})
+                    values.update(stored)
+                finally:
+                    self.releaseLeases(leased)
+                leasedKeys = set(leased)
+                missing = [key for key in missing if key not in leasedKeys]
+            if missing:
+                time.sleep(self.pollInterval)
+                values.update(self.getMany(missing))
+                missing = [key for key in missing if key not in values]
+        return values
+
+    def purge(self):
+        '''
+        Deletes expired values and leases.
+        '''
+        now = time.time()
+        connection = self.connection()
+        with self.transaction(connection):
+            connection.execute("DELETE FROM refData WHERE expires <= ?", (now,))
+            connection.execute("DELETE FROM leases WHERE expires <= ?", (now,))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('local')
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.local = threading.local()
+
+class BbgImmediateTransaction:
+    def __init__(self, connection):
+        # BEGIN IMMEDIATE takes the write lock up front so concurrent writers queue on the busy timeout instead of failing mid transaction
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, excType, excValue, traceback):
+        self.connection.execute("COMMIT" if excType is None else "ROLLBACK")
+
+def cacheKey(kind, security, field, overrides = None):
+    return json.dumps([kind, security, field, sorted((overrides or {}).items())], default = str)
+
+def benchmarkReader(path, keys, batchSize, seconds, results):
+    cache = BbgSharedCache(path)
+    reads = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        cache.getMany(random.sample(keys, batchSize))
+        reads += batchSize
+    results.put(reads)
+
+def benchmark(path, readers = 32, keyCount = 10000, batchSize = 50, seconds = 5.0):
+    '''
+    Fills a cache at path with keyCount values shaped like BbgDataPoint fields and measures the keys read per second by readers concurrent processes, each reading random batches of batchSize keys.
+    '''
+    cache = BbgSharedCache(path)
+    keys = [cacheKey('BbgDataPoint', 'SEC{:05d} Equity'.format(i), 'PX_LAST') for i in range(keyCount)]
+    cache.putMany({key: (100.0 + i / 100, 3600) for i, key in enumerate(keys)})
+
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target = benchmarkReader, args = (path, keys, batchSize, seconds, results)) for i in range(readers)]
+    for process in processes:
+        process.start()
+    reads = sum(results.get() for process in processes)
+    for process in processes:
+        process.join()
+    return {'readers': readers, 'keys': keyCount, 'batchSize': batchSize, 'seconds': seconds, 'readsPerSecond': reads / seconds}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark shared reference data cache reads under concurrent readers')
+    parser.add_argument('path', help = 'SQLite database to benchmark, created if it does not exist')
+    parser.add_argument('--readers', type = int, default = 32)
+    parser.add_argument('--keys', type = int, default = 10000)
+    parser.add_argument('--batch-size', type = int, default = 50)
+    parser.add_argument('--seconds', type = float, default = 5.0)
+    args = parser.parse_args()
+    print(benchmark(args.path, readers = args.readers, keyCount = args.keys, batchSize = args.batch_size, seconds = args.seconds))
@@ -0,0 +1,137 @@
+import numpy as np
+from . import BbgLogger
+
+logger = BbgLogger.logger
+
+CONDITION_SEPARATOR = ','
+# Set on the masks of condition code strings holding a flag past the first 63, the other bits then hold the index of the whole string
+OVERFLOW_BIT = 1 << 63
+MAX_CONDITION_FLAGS = 63
+
+class BbgTickDictionary:
+    def __init__(self, types = (), conditions = (), overflow = ()):
+        '''
+        Interning dictionary for tick event types and condition codes.  Event types are encoded as uint8 codes and condition code strings such as 'OR,CX' as uint64 bitmasks with one bit per individual condition flag, so ticks can be filtered on their conditions with vectorized bitwise operations.  One dictionary is meant to be shared by every tick query of a session so the codes stay comparable.
+
+        Parameters
+        ----------
+        types : list, optional
+            Event types already interned, in code order.
+        conditions : list, optional
+            Condition flags already interned, in bit order.
+        overflow : list, optional
+            Condition code strings already interned whole, in index order.
+
+        Notes
+        -----
+        The first 63 distinct condition flags get a bit each.  Condition code strings holding any later flag are interned whole instead, their mask has the top bit set and holds the index of the string.  hasConditions, excludeConditions and decodeConditions handle both kinds of mask, code filtering directly on flagsMask does not match the whole strings.
+
+        Examples
+        --------
+        >>> import datetime as dt
+
+        >>> import BloombergData as bbg
+
+        >>> tickDictionary = bbg.BbgTickDictionary()
+
+        >>> ticks = bbg.BbgIntradayTick(fields = ['TRADE'], securities = ['YMH0 Comdty'], startTime = dt.datetime(2020, 1, 30), endTime = dt.datetime(2020, 1, 31), tickDictionary = tickDictionary).constructDf()
+
+        >>> ticks[tickDictionary.excludeConditions(ticks['conditionCodes'].values, ['OR', 'CX'])]
+        '''
+        self.types = []
+        self.typeCodes = {}
+        self.conditions = []
+        self.conditionBits = {}
+        # Masks of whole condition code strings, ticks mostly repeat a handful of them
+        self.conditionMasks = {'': 0}
+        self.overflowCodes = []
+        for eventType in types:
+            self.internType(eventType)
+        for flag in conditions:
+            self.internCondition(flag)
+        for conditionCodes in overflow:
+            self.internOverflow(conditionCodes)
+
+    def internType(self, eventType):
+        code = self.typeCodes.get(eventType)
+        if code is None:
+            if len(self.types) > np.iinfo(np.uint8).max:
+                raise OverflowError('More than {} distinct tick event types'.format(np.iinfo(np.uint8).max + 1))
+            code = self.typeCodes[eventType] = len(self.types)
+            self.types.append(eventType)
+        return code
+
+    def internCondition(self, flag):
+        # Returns None once every bit is taken
+        bit = self.conditionBits.get(flag)
+        if bit is None and len(self.conditions) < MAX_CONDITION_FLAGS:
+            bit = self.conditionBits[flag] = len(self.conditions)
+            self.conditions.append(flag)
+        return bit
+
+    def internOverflow(self, conditionCodes):
+        mask = OVERFLOW_BIT | len(self.overflowCodes)
+        self.overflowCodes.append(conditionCodes)
+        self.conditionMasks[conditionCodes] = mask
+        return mask
+
+    def internConditionCodes(self, conditionCodes):
+        mask = self.conditionMasks.get(conditionCodes)
+        if mask is None:
+            mask = 0
+            for flag in splitConditions(conditionCodes):
+                bit = self.internCondition(flag)
+                if bit is None:
+                    logger.info('Tick condition flags exhausted, interning {!r} whole'.format(conditionCodes))
+                    return self.internOverflow(conditionCodes)
+                mask |= 1 << bit
+            self.conditionMasks[conditionCodes] = mask
+        return mask
+
+    def encodeTypes(self, values):
+        return np.fromiter((self.internType('' if value is None else value) for value in values), dtype = np.uint8, count = len(values))
+
+    def encodeConditions(self, values):
+        return np.fromiter((self.internConditionCodes('' if value is None else value) for value in values), dtype = np.uint64, count = len(values))
+
+    def decodeTypes(self, codes):
+        return np.asarray(self.types, dtype = object)[np.asarray(codes, dtype = np.intp)]
+
+    def decodeConditions(self, masks):
+        masks = np.asarray(masks, dtype = np.uint64)
+        uniqueMasks, inverse = np.unique(masks, return_inverse = True)
+        decoded = np.array([self.overflowCodes[int(mask) & ~OVERFLOW_BIT] if int(mask) & OVERFLOW_BIT else CONDITION_SEPARATOR.join(flag for bit, flag in enumerate(self.conditions) if int(mask) >> bit & 1) for mask in uniqueMasks], dtype = object)
+        return decoded[inverse.reshape(masks.shape)]
+
+    def flagsMask(self, flags):
+        '''
+        Returns the bitmask of the condition flags passed.  Flags never seen by the dictionary cannot be set on any tick and are ignored.
+        '''
+        flags = [flags] if isinstance(flags, str) else flags
+        mask = 0
+        for flag in flags:
+            if flag in self.conditionBits:
+                mask |= 1 << self.conditionBits[flag]
+        return np.uint64(mask)
+
+    def hasConditions(self, masks, flags):
+        masks = np.asarray(masks, dtype = np.uint64)
+        has = (masks & self.flagsMask(flags)) != 0
+        if self.overflowCodes:
+            overflowed = (masks & np.uint64(OVERFLOW_BIT)) != 0
+            if overflowed.any():
+                # Whole strings are matched once each, then looked up by index
+                flags = {flags} if isinstance(flags, str) else set(flags)
+                matching = np.array([bool(flags.intersection(splitConditions(conditionCodes))) for conditionCodes in self.overflowCodes], dtype = bool)
+                has[overflowed] = matching[(masks[overflowed] & np.uint64(OVERFLOW_BIT - 1)).astype(np.intp)]
+        return has
+
+    def excludeConditions(self, masks, flags):
+        return ~self.hasConditions(masks, flags)
+
+    def typeMask(self, codes, types):
+        types = [types] if isinstance(types, str) else types
+        return np.isin(np.asarray(codes), [self.typeCodes[eventType] for eventType in types if eventType in self.typeCodes])
+
+def splitConditions(conditionCodes):
+    return [flag.strip() for flag in conditionCodes.split(CONDITION_SEPARATOR) if flag.strip()]
@@ -0,0 +1,273 @@
+import collections
+import datetime as dt
+import json
+import os
+import shutil
+import urllib.parse
+import numpy as np
+from .BbgTickDictionary import BbgTickDictionary
+from . import BbgLogger
+
+logger = BbgLogger.logger
+
+NS_PER_DAY = 86400 * 10**9
+# Every INDEX_STRIDE-th timestamp of a partition is kept in its sparse index
+INDEX_STRIDE = 4096
+
+TICK_COLUMNS = {
+    'time': np.int64,
+    'value': np.float64,
+    'size': np.int64,
+    'type': np.uint8,
+    'conditionCodes': np.uint64
+}
+
+class BbgTickStore:
+    def __init__(self, path):
+        '''
+        Persistent on-disk tick store.  Ticks are kept per security in date partitions (UTC) of memory-mappable columnar files: int64 nanosecond timestamps, float64 prices, int64 sizes, uint8 event type codes and uint64 condition code bitmasks encoded with a per security BbgTickDictionary.  Each partition carries a sparse index of every 4096th timestamp so range reads only touch the pages they return.
+
+        Parameters
+        ----------
+        path : string
+            Directory holding the store, created if it does not exist.
+
+        Notes
+        -----
+        A store supports a single writing process at a time.  Partitions are written to a temporary directory and swapped in, so readers in other processes never see a partially written partition, and a partition left half swapped by a crash is recovered by the next write.  The store records the time intervals it holds per security, so filling it again only requests the gaps.
+
+        See Also
+        --------
+        BbgIntradayTick.fillStore : Incrementally fills a store with tick data.
+
+        Examples
+        --------
+        >>> import datetime as dt
+
+        >>> import BloombergData as bbg
+
+        >>> store = bbg.BbgTickStore('/data/ticks')
+
+        >>> bbg.BbgIntradayTick(fields = ['TRADE'], securities = ['YMH0 Comdty'], startTime = dt.datetime(2020, 1, 30), endTime = dt.datetime(2020, 1, 31)).fillStore(store)
+
+        >>> ticks = store.read('YMH0 Comdty', dt.datetime(2020, 1, 30, 1), dt.datetime(2020, 1, 30, 2))
+
+        >>> store.decode('YMH0 Comdty', 'type', ticks['type'])
+
+        >>> store.dictionary('YMH0 Comdty').excludeConditions(ticks['conditionCodes'], ['OR', 'CX'])
+        '''
+        self.path = path
+        os.makedirs(self.path, exist_ok = True)
+
+    def securityPath(self, security):
+        return os.path.join(self.path, urllib.parse.quote(security, safe = ''))
+
+    def partitionPath(self, security, day):
+        return os.path.join(self.securityPath(security), (dt.date(1970, 1, 1) + dt.timedelta(days = int(day))).strftime('%Y%m%d'))
+
+    def loadMetadata(self, security):
+        metadataPath = os.path.join(self.securityPath(security), 'metadata.json')
+        if not os.path.exists(metadataPath):
+            return {'covered': [], 'type': [], 'conditionCodes': [], 'conditionOverflow': []}
+        with open(metadataPath, 'r') as f:
+            metadata = json.load(f)
+        metadata.setdefault('covered', [])
+        metadata.setdefault('conditionOverflow', [])
+        return metadata
+
+    def saveMetadata(self, security, metadata):
+        metadataPath = os.path.join(self.securityPath(security), 'metadata.json')
+        with open(metadataPath + '.tmp', 'w') as f:
+            json.dump(metadata, f)
+        os.replace(metadataPath + '.tmp', metadataPath)
+
+    def coveredIntervals(self, security):
+        '''
+        Returns the sorted, disjoint (start, end) time intervals fully written for security as naive UTC datetimes.
+        '''
+        return [(toDatetime(start), toDatetime(end)) for start, end in self.loadMetadata(security)['covered']]
+
+    def missingIntervals(self, security, startTime, endTime):
+        '''
+        Returns the (start, end) intervals between startTime and endTime not yet written for security.
+        '''
+        startNs, endNs = toNs(startTime), toNs(endTime)
+        missing = []
+        for coveredStart, coveredEnd in self.loadMetadata(security)['covered']:
+            if coveredEnd <= startNs:
+                continue
+            if coveredStart >= endNs:
+                break
+            if coveredStart > startNs:
+                missing.append((startNs, coveredStart))
+            startNs = max(startNs, coveredEnd)
+        if startNs < endNs:
+            missing.append((startNs, endNs))
+        return [(toDatetime(start), toDatetime(end)) for start, end in missing]
+
+    def append(self, security, columns, covered = None):
+        '''
+        Appends ticks to the store.  columns holds equal length time, value, size, type and conditionCodes sequences, times being naive UTC datetimes or datetime64 values.  A tick already stored is skipped once per stored copy, so overlapping fills do not duplicate data while identical ticks within a fetch are all kept.  covered is the (start, end) interval the ticks were fetched for, recorded once they are written.
+        '''
+        os.makedirs(self.securityPath(security), exist_ok = True)
+        self.recoverPartitions(security)
+        metadata = self.loadMetadata(security)
+        times = np.asarray(columns.get('time', []), dtype = 'datetime64[ns]').astype(np.int64)
+        count = len(times)
+        encoded = {
+            'time': times,
+            'value': np.asarray(columns.get('value', np.full(count, np.nan)), dtype = np.float64),
+            'size': np.asarray([0 if size is None else size for size in columns.get('size', np.zeros(count))], dtype = np.int64)
+        }
+        dictionary = BbgTickDictionary(metadata['type'], metadata['conditionCodes'], metadata['conditionOverflow'])
+        encoded['type'] = dictionary.encodeTypes(columns.get('type', [''] * count))
+        encoded['conditionCodes'] = dictionary.encodeConditions(columns.get('conditionCodes', [''] * count))
+        metadata['type'] = dictionary.types
+        metadata['conditionCodes'] = dictionary.conditions
+        metadata['conditionOverflow'] = dictionary.overflowCodes
+        # Codes only ever get appended to the dictionary, saving it before the partitions means no partition holds codes it cannot decode
+        self.saveMetadata(security, metadata)
+
+        order = np.argsort(times, kind = 'mergesort')
+        encoded = {column: values[order] for column, values in encoded.items()}
+        days = encoded['time'] // NS_PER_DAY
+        for day in np.unique(days):
+            inDay = days == day
+            self.writePartition(security, day, {column: values[inDay] for column, values in encoded.items()})
+
+        if covered is not None:
+            metadata['covered'] = mergeIntervals(metadata['covered'] + [[toNs(covered[0]), toNs(covered[1])]])
+            self.saveMetadata(security, metadata)
+        logger.info('Appended {} ticks for {} to tick store {}'.format(count, security, self.path))
+
+    def dictionary(self, security):
+        metadata = self.loadMetadata(security)
+        return BbgTickDictionary(metadata['type'], metadata['conditionCodes'], metadata['conditionOverflow'])
+
+    def decode(self, security, column, codes):
+        if column == 'type':
+            return self.dictionary(security).decodeTypes(codes)
+        return self.dictionary(security).decodeConditions(codes)
+
+    def writePartition(self, security, day, columns):
+        partitionPath = self.partitionPath(security, day)
+        if os.path.exists(partitionPath):
+            existing = {column: np.load(os.path.join(partitionPath, column + '.npy')) for column in TICK_COLUMNS}
+            columns = self.mergePartition(existing, columns)
+
+        tempPath = partitionPath + '.tmp'
+        shutil.rmtree(tempPath, ignore_errors = True)
+        os.makedirs(tempPath)
+        for column, dtype in TICK_COLUMNS.items():
+            saveArray(os.path.join(tempPath, column + '.npy'), np.ascontiguousarray(columns[column], dtype = dtype))
+        saveArray(os.path.join(tempPath, 'sparseIndex.npy'), columns['time'][::INDEX_STRIDE])
+
+        # Swap the new partition in so it is never read half written.  A crash between the two renames leaves only the .old partition, restored by recoverPartitions.
+        if os.path.exists(partitionPath):
+            os.replace(partitionPath, partitionPath + '.old')
+        os.replace(tempPath, partitionPath)
+        shutil.rmtree(partitionPath + '.old', ignore_errors = True)
+
+    def recoverPartitions(self, security):
+        '''
+        Restores partitions left half swapped by a crashed write and removes leftover temporary partitions.
+        '''
+        securityPath = self.securityPath(security)
+        for name in os.listdir(securityPath):
+            path = os.path.join(securityPath, name)
+            if name.endswith('.old') and os.path.isdir(path):
+                if os.path.exists(path[:-len('.old')]):
+                    shutil.rmtree(path, ignore_errors = True)
+                else:
+                    logger.info('Restoring tick store partition {} left by an interrupted write'.format(path))
+                    os.replace(path, path[:-len('.old')])
+            elif name.endswith('.tmp') and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors = True)
+
+    def mergePartition(self, existing, columns):
+        if len(existing['time']) and len(columns['time']) and columns['time'][0] <= existing['time'][-1]:
+            # Only the time range both hold can repeat stored ticks.  Each stored tick absorbs one identical new tick, so ticks genuinely repeated within a fetch are all kept.
+            overlapStart = np.searchsorted(existing['time'], columns['time'][0], side = 'left')
+            overlapEnd = np.searchsorted(existing['time'], columns['time'][-1], side = 'right')
+            newEnd = np.searchsorted(columns['time'], existing['time'][-1], side = 'right')
+            storedRows = collections.Counter(zip(*(existing[column][overlapStart:overlapEnd].tolist() for column in TICK_COLUMNS)))
+            keep = np.ones(len(columns['time']), dtype = bool)
+            for i, row in enumerate(zip(*(columns[column][:newEnd].tolist() for column in TICK_COLUMNS))):
+                if storedRows[row] > 0:
+                    storedRows[row] -= 1
+                    keep[i] = False
+            columns = {column: values[keep] for column, values in columns.items()}
+        merged = {column: np.concatenate([existing[column], columns[column]]) for column in TICK_COLUMNS}
+        order = np.argsort(merged['time'], kind = 'mergesort')
+        return {column: values[order] for column, values in merged.items()}
+
+    def partitionDays(self, security, startNs, endNs):
+        securityPath = self.securityPath(security)
+        if not os.path.exists(securityPath):
+            return []
+        days = set()
+        for name in os.listdir(securityPath):
+            # A partition only left as .old by a crashed write is read from there until the next write recovers it
+            name = name[:-len('.old')] if name.endswith('.old') else name
+            if len(name) == 8 and name.isdigit():
+                day = (dt.datetime.strptime(name, '%Y%m%d').date() - dt.date(1970, 1, 1)).days
+                if startNs // NS_PER_DAY <= day <= endNs // NS_PER_DAY:
+                    days.add(day)
+        return sorted(days)
+
+    def readablePartitionPath(self, security, day):
+        partitionPath = self.partitionPath(security, day)
+        return partitionPath if os.path.exists(partitionPath) else partitionPath + '.old'
+
+    def readPartitions(self, security, startTime, endTime):
+        '''
+        Yields, per date partition, a dictionary of the columns of the ticks with startTime <= time < endTime.  The arrays are read-only views of the memory-mapped partition files.
+        '''
+        startNs = toNs(startTime)
+        endNs = toNs(endTime)
+        for day in self.partitionDays(security, startNs, endNs):
+            partitionPath = self.readablePartitionPath(security, day)
+            times = np.load(os.path.join(partitionPath, 'time.npy'), mmap_mode = 'r')
+            sparseIndex = np.load(os.path.join(partitionPath, 'sparseIndex.npy'))
+            lo = searchTimes(times, sparseIndex, startNs)
+            hi = searchTimes(times, sparseIndex, endNs)
+            if hi > lo:
+                yield {column: np.load(os.path.join(partitionPath, column + '.npy'), mmap_mode = 'r')[lo:hi] for column in TICK_COLUMNS}
+
+    def read(self, security, startTime, endTime):
+        '''
+        Returns a dictionary of the columns of the ticks with startTime <= time < endTime.  Reads within a single date partition return zero-copy views of the memory-mapped files, reads spanning several partitions are concatenated.
+        '''
+        partitions = list(self.readPartitions(security, startTime, endTime))
+        if len(partitions) == 1:
+            return partitions[0]
+        return {column: np.concatenate([partition[column] for partition in partitions]) if partitions else np.empty(0, dtype = dtype) for column, dtype in TICK_COLUMNS.items()}
+
+def searchTimes(times, sparseIndex, t):
+    # The sparse index narrows the binary search to the block holding t so only its pages are read
+    block = np.searchsorted(sparseIndex, t, side = 'left')
+    lo = max(block - 1, 0) * INDEX_STRIDE
+    hi = min(block * INDEX_STRIDE + 1, len(times))
+    return lo + int(np.searchsorted(times[lo:hi], t, side = 'left'))
+
+def saveArray(path, values):
+    # Flushed to disk before the partition is swapped in so a crash cannot leave a swapped in partition with missing data
+    with open(path, 'wb') as f:
+        np.save(f, values)
+        f.flush()
+        os.fsync(f.fileno())
+
+def mergeIntervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def toNs(time):
+    return int(np.datetime64(time, 'ns').astype(np.int64))
+
+def toDatetime(ns):
+    return dt.datetime(1970, 1, 1) + dt.timedelta(microseconds = ns // 1000)
@@ -2,4 +2,17 @@ from BloombergData.BbgDataHistory import BbgDataHistory
 # Need to extend BbgDataPoint to allow it to handle lists of overrides where required
 from BloombergData.BbgDataPoint import BbgDataPoint
 from BloombergData.BbgDataService import BbgDataService
-from BloombergData.bbgIntradayBar import BbgIntradayBar
\ No newline at end of file
+from BloombergData.bbgIntradayBar import BbgIntradayBar
+from BloombergData.BbgIntradayTick import BbgIntradayTick
+from BloombergData.BbgGateway import BbgGateway, setGatewayAddress
+from BloombergData.BbgQueryPlan import BbgQueryPlan
+from BloombergData.BbgFieldCache import BbgFieldCache, BbgFieldInfo, staticLookup
+from BloombergData.BbgOverrideSweep import BbgOverrideSweep
+from BloombergData.BbgTickStore import BbgTickStore
+from BloombergData.BbgTickDictionary import BbgTickDictionary
+from BloombergData.BbgLazyHistory import BbgLazyHistory
+from BloombergData.BbgFetchJob import BbgFetchJob
+from BloombergData.BbgAdaptiveController import BbgAdaptiveController
+from BloombergData.BbgSession import BbgManagedSession
+from BloombergData.BbgProfiler import BbgProfiler
+from BloombergData.BbgSharedCache import BbgSharedCache
@@ -5,6 +5,10 @@ from .BbgRefDataService import BbgRefDataService
 import pandas as pd
 import numpy as np
 from . import BbgLogger
+from .BbgProfiler import timedStage
+from .BbgGateway import useGateway, submitQuery
+from .BbgOutput import BbgColumnBuffer, checkOutputFormat, columnsToOutput, concatColumns
+from .BbgFetchJob import BbgFetchJob
 import pytz
 from tzlocal import get_localzone
 
@@ -28,7 +32,7 @@ NUM_EVENTS = blpapi.Name("numEvents")
 TIME = blpapi.Name("time")
 
 class BbgIntradayBar(BbgRefDataService):
-    def __init__(self, securities, startTime, endTime, event = "TRADE", barInterval = 60, timeZone = str(get_localzone()), gapFillInitialBar = False, adjustmentSplit = True, adjustmentAbnormal = False, adjustmentNormal = False, adjustmentFollowDPDF = True):
+    def __init__(self, securities, startTime, endTime, event = "TRADE", barInterval = 60, timeZone = str(get_localzone()), gapFillInitialBar = False, adjustmentSplit = True, adjustmentAbnormal = False, adjustmentNormal = False, adjustmentFollowDPDF = True, outputFormat = 'pandas', session = None, controller = None):
         '''
             Bloomberg Intraday Bar query object.  Allows user to input a list of securities retrieval over a specified time period subject to the usual constraints that apply to Bloomberg Intraday Bar data retrieval.
 
@@ -58,6 +62,12 @@ class BbgIntradayBar(BbgRefDataService):
             Adjust historical pricing to reflect: Regular Cash, Interim, 1st Interim, 2nd Interim, 3rd Interim, 4th Interim, 5th Interim, Income, Estimated, Partnership Distribution, Final, Interest on Capital, Distribution, Prorated.  If not set, will be set to False.
         adjustmentFollowDPDF : bool
             Setting to True will follow the DPDF <GO> Terminal function. True is the default setting for this option.  If not set, will be set to True.
+        outputFormat : string, default pandas
+            The type of table returned by constructDf.  One of pandas, arrow (pyarrow.Table) or polars (polars.DataFrame).  The arrow and polars tables are built directly from the decoded column buffers without an intermediate pandas DataFrame, with time typed as a timestamp in timeZone.
+        session : BbgRefDataService, optional
+            An already started session to run the query on instead of opening a new one.  The session is left open once the query completes.
+        controller : BbgAdaptiveController, optional
+            When passed, the time range of each security is split into windows requested concurrently, the window length and number of requests in flight being adjusted by the controller from the latency and size of the responses.
         
         See Also
         --------
@@ -65,6 +75,7 @@ class BbgIntradayBar(BbgRefDataService):
         BbgDataPoint : Retrieve single point static, calculated or other reference data.
         BbgIntradayTick : Retrieve historic tick-level data for a given security.
         BbgIntradayBar : Retrieve historic bar level data for a given security (open, high, low and close) for a specified time interval given in minutes.
+        BbgIntradayBar.fetchJob : Runs the query as a resumable job checkpointed per security and time window.
 
         Examples
         --------
@@ -98,6 +109,9 @@ class BbgIntradayBar(BbgRefDataService):
         self.adjustmentAbnormal = adjustmentAbnormal
         self.adjustmentNormal = adjustmentNormal
         self.adjustmentFollowDPDF = adjustmentFollowDPDF
+        self.outputFormat = checkOutputFormat(outputFormat)
+        self.sharedSession = session
+        self.controller = controller
 
     def constructDf(self):
         '''
@@ -109,7 +123,7 @@ class BbgIntradayBar(BbgRefDataService):
 
         Returns
         -------
-        table : DataFrame
+        table : DataFrame, pyarrow.Table or polars.DataFrame depending on outputFormat
 
         Raises
         ------
@@ -147,32 +161,72 @@ class BbgIntradayBar(BbgRefDataService):
                             2020-01-31 09:25:00+11:00	99.38	99.38	99.375	99.38	2170	35	        215655
                             2020-01-31 09:30:00+11:00	99.38	99.38	99.375	99.38	93	    3	        9241.89
         '''
-        BbgRefDataService.__init__(self)
-        self.bbgRefData = pd.DataFrame()
-
-        UTCStartTime = self.__convertFromTimezoneToUTC(self.startTime, self.timeZone)
-        UTCEndTime = self.__convertFromTimezoneToUTC(self.endTime, self.timeZone)
-
+        if useGateway():
+            return submitQuery(self)
+        BbgRefDataService.__init__(self, session = self.sharedSession)
+        if self.controller is not None:
+            return self.columnsToTable(self.fetchWindowColumns())
+        self.bbgRefData = BbgColumnBuffer(['Security'])
 
         for sec in self.securities:
-            self.request = self.createIntradayBarRequest(security = sec, requestType = "IntradayBarRequest", startTime = UTCStartTime, endTime = UTCEndTime, event = self.event, barInterval = self.barInterval, gapFillInitialBar = self.gapFillInitialBar, adjustmentSplit = self.adjustmentSplit, adjustmentAbnormal = self.adjustmentAbnormal, adjustmentNormal = self.adjustmentNormal, adjustmentFollowDPDF = self.adjustmentFollowDPDF)
-            self.cid = self.session.sendRequest(self.request)
-            for response in self.parseResponse(self.cid, False):
-                self.bbgRefData = self.bbgRefData.append(self.refDataContentToDf(response, sec))
+            self.fetchSecurityColumns(sec, self.startTime, self.endTime, self.bbgRefData)
         BbgRefDataService.__del__(self)
-        self.bbgRefData['time'] = self.bbgRefData['time'].apply(lambda x: self.__convertFromUTCToTimezone(x, self.timeZone))
-        return self.bbgRefData.set_index(['Security', 'time'])
+        return self.columnsToTable(self.bbgRefData.columns)
+
+    def fetchWindowColumns(self):
+        # Windows complete out of order, each is decoded into its own buffer and concatenated in security then time order
+        buffers = {}
+
+        def requests():
+            for window in self.timeWindows("IntradayBarRequest", step = 60 * self.barInterval):
+                buffers[window] = BbgColumnBuffer(['Security'])
+                yield window, self.createSecurityRequest(*window)
+
+        for window, response, final in self.parseControlledResponses(requests(), "IntradayBarRequest", self.responseRows):
+            self.refDataContentToColumns(response, window[0], buffers[window])
+        return concatColumns([columns.columns for columns in buffers.values()])
+
+    def createSecurityRequest(self, security, startTime, endTime):
+        UTCStartTime = self.__convertFromTimezoneToUTC(startTime, self.timeZone)
+        UTCEndTime = self.__convertFromTimezoneToUTC(endTime, self.timeZone)
+        return self.createIntradayBarRequest(security = security, requestType = "IntradayBarRequest", startTime = UTCStartTime, endTime = UTCEndTime, event = self.event, barInterval = self.barInterval, gapFillInitialBar = self.gapFillInitialBar, adjustmentSplit = self.adjustmentSplit, adjustmentAbnormal = self.adjustmentAbnormal, adjustmentNormal = self.adjustmentNormal, adjustmentFollowDPDF = self.adjustmentFollowDPDF)
+
+    def requestTimeUTC(self, time):
+        return self.__convertFromTimezoneToUTC(time, self.timeZone).replace(tzinfo = None)
+
+    def responseRows(self, response):
+        return len(response['content']['IntradayBarResponse']['barData']['barTickData'])
+
+    def fetchSecurityColumns(self, security, startTime, endTime, columns):
+        self.request = self.createSecurityRequest(security, startTime, endTime)
+        self.cid = self.session.sendRequest(self.request)
+        for response in self.parseResponse(self.cid, False):
+            self.refDataContentToColumns(response, security, columns)
+        return columns
+
+    @timedStage('build')
+    def columnsToTable(self, columns):
+        if self.outputFormat == 'pandas':
+            returnDf = pd.DataFrame(columns)
+            returnDf['time'] = pd.to_datetime(returnDf['time']).dt.tz_localize('UTC').dt.tz_convert(self.timeZone)
+            return returnDf.set_index(['Security', 'time'])
+        return columnsToOutput(columns, self.outputFormat, timeZones = {'time': self.timeZone})
+
+    def fetchJob(self, path, window = dt.timedelta(days = 1), maxRetries = 3, backoff = 1.0):
+        '''
+        Returns a resumable BbgFetchJob of this query checkpointing each (security, time window) unit under path.
+        '''
+        return BbgFetchJob(self, path, window = window, maxRetries = maxRetries, backoff = backoff)
 
-    def refDataContentToDf(self, response, security):
+    @timedStage('decode')
+    def refDataContentToColumns(self, response, security, columns):
         securityData = response['content']['IntradayBarResponse']['barData']
         barData = securityData['barTickData']
-        returnDf = pd.DataFrame()
         for snapShot in barData:
-            fieldData = snapShot['barTickData']
-            returnDf = returnDf.append(pd.DataFrame(fieldData.items(), columns=['Field', 'Values']).set_index('Field').transpose().reset_index(drop=True))#, index = [fieldData['time'] for i in range(0, len(fieldData))])[1:])
-        returnDf.index.names = ['time']
-        returnDf['Security'] = security
-        return returnDf
+            row = {'Security': security}
+            row.update(snapShot['barTickData'])
+            columns.appendRow(row)
+        return columns
 
     def __convertFromUTCToTimezone(self, fromDt, toTimeZone):
         return pytz.utc.localize(fromDt).astimezone(pytz.timezone(toTimeZone))
@@ -0,0 +1,69 @@
+import datetime as dt
+import unittest
+
+try:
+    import pandas as pd
+    from BloombergData.BbgDataHistory import BbgDataHistory
+except ImportError:
+    # The package imports blpapi on import
+    BbgDataHistory = None
+
+def historyResponse(security, snapshots):
+    return {'content': {'HistoricalDataResponse': {'securityData': {'security': security, 'fieldData': [{'fieldData': fieldData} for fieldData in snapshots]}}}}
+
+def pivotResponses(responses):
+    # The long format pivot BbgDataHistory.constructDf built its frame with before the columns were aligned directly
+    rows = []
+    for response in responses:
+        securityData = response['content']['HistoricalDataResponse']['securityData']
+        for snapShot in securityData['fieldData']:
+            fieldData = snapShot['fieldData']
+            rows.extend({'Date': fieldData['date'], 'Field': field, 'Values': value, 'Security': securityData['security']} for field, value in fieldData.items() if field != 'date')
+    pivoted = pd.DataFrame(rows).set_index(['Date', 'Security']).pivot(columns = 'Field').unstack('Security')
+    pivoted.columns = pivoted.columns.droplevel(0).swaplevel()
+    return pivoted
+
+def day(i):
+    return dt.date(2020, 1, 1) + dt.timedelta(days = i)
+
+@unittest.skipIf(BbgDataHistory is None, 'BloombergData dependencies are not installed')
+class BbgDataHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.query = BbgDataHistory(fields = ['PX_LAST', 'PX_BID', 'NAME'], securities = ['A', 'B'], startDate = '20200101', endDate = '20200110')
+
+    def alignResponses(self, responses):
+        columns = self.query.newResponseColumns()
+        for response in responses:
+            self.query.refDataContentToColumns(response, columns)
+        return self.query.alignHistoryColumns(columns)
+
+    def assertMatchesPivot(self, responses):
+        aligned = self.alignResponses(responses)
+        pivoted = pivotResponses(responses)
+        self.assertEqual(list(aligned.columns), list(pivoted.columns))
+        self.assertEqual(list(aligned.index), list(pivoted.index))
+        for column in aligned.columns:
+            self.assertEqual([None if pd.isna(value) else value for value in aligned[column]], [None if pd.isna(value) else value for value in pivoted[column]], column)
+
+    def testNumericParityWithPivot(self):
+        # Partial responses of the same security, dates out of order and a field B returns that A does not
+        self.assertMatchesPivot([
+            historyResponse('B', [{'date': day(2), 'PX_LAST': 2.5, 'PX_BID': 2.4}, {'date': day(0), 'PX_LAST': 2.0, 'PX_BID': 1.9}]),
+            historyResponse('A', [{'date': day(1), 'PX_LAST': 1.0}, {'date': day(3), 'PX_LAST': 1.5}]),
+            historyResponse('B', [{'date': day(3), 'PX_LAST': None, 'PX_BID': 3}])
+        ])
+
+    def testMissingFieldIsAllNaN(self):
+        aligned = self.alignResponses([historyResponse('A', [{'date': day(0), 'PX_LAST': 1.0}]), historyResponse('B', [{'date': day(0), 'PX_LAST': 2.0, 'PX_BID': 1.9}])])
+        self.assertIn(('A', 'PX_BID'), aligned.columns)
+        self.assertTrue(aligned[('A', 'PX_BID')].isna().all())
+
+    def testLateStringFallsBackToObjects(self):
+        responses = [historyResponse('A', [{'date': day(0), 'PX_LAST': 1.0, 'NAME': 'X'}, {'date': day(1), 'PX_LAST': 'N.A.', 'NAME': 'X'}]), historyResponse('B', [{'date': day(1), 'PX_LAST': 2.0, 'NAME': None}])]
+        aligned = self.alignResponses(responses)
+        self.assertEqual(aligned[('A', 'PX_LAST')].tolist(), [1.0, 'N.A.'])
+        self.assertEqual(aligned[('B', 'PX_LAST')].dtype, float)
+        self.assertMatchesPivot(responses)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import datetime as dt
+import shutil
+import tempfile
+import unittest
+
+try:
+    from BloombergData.BbgFetchJob import BbgFetchJob
+    from BloombergData.BbgOutput import BbgColumnBuffer
+except ImportError:
+    # The package imports blpapi and pandas on import
+    BbgFetchJob = None
+
+START = dt.datetime(2020, 1, 31, 9, 0)
+END = dt.datetime(2020, 1, 31, 17, 0)
+
+class CannedBars:
+    # Stands in for a UTC BbgIntradayBar, returning a bar at every interval from start to end inclusive like the terminal returns ticks
+    def __init__(self, barInterval):
+        self.securities = ['YMH0 Comdty', 'XMH0 Comdty']
+        self.startTime = START
+        self.endTime = END
+        self.barInterval = barInterval
+
+    def requestTimeUTC(self, time):
+        return time
+
+    def fetchSecurityColumns(self, security, startTime, endTime, columns):
+        time = startTime
+        while time <= endTime:
+            columns.appendRow({'Security': security, 'time': time, 'close': 1.0})
+            time += dt.timedelta(minutes = self.barInterval)
+        return columns
+
+    def columnsToTable(self, columns):
+        return columns
+
+if BbgFetchJob is not None:
+    class CannedFetchJob(BbgFetchJob):
+        def fetchUnit(self, unit):
+            return self.query.fetchSecurityColumns(unit['security'], unit['start'], unit['end'], BbgColumnBuffer(['Security']))
+
+@unittest.skipIf(BbgFetchJob is None, 'BloombergData dependencies are not installed')
+class BbgFetchJobTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors = True)
+
+    def testWindowIsRoundedUpToWholeBars(self):
+        job = CannedFetchJob(CannedBars(barInterval = 25), self.directory, window = dt.timedelta(hours = 1))
+        self.assertEqual(job.window, dt.timedelta(minutes = 75))
+        for unit in job.units():
+            self.assertEqual((unit['start'] - START) % dt.timedelta(minutes = 25), dt.timedelta(0))
+
+    def testBoundaryRowsAreReturnedOnce(self):
+        query = CannedBars(barInterval = 5)
+        result = CannedFetchJob(query, self.directory, window = dt.timedelta(minutes = 50)).run().result()
+        expected = query.fetchSecurityColumns('YMH0 Comdty', START, END, BbgColumnBuffer(['Security']))
+        query.fetchSecurityColumns('XMH0 Comdty', START, END, expected)
+        self.assertEqual(result, expected.columns)
+
+if __name__ == '__main__':
+    unittest.main()
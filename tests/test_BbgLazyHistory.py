@@ -0,0 +1,68 @@
+import datetime as dt
+import unittest
+
+try:
+    import pandas as pd
+    from BloombergData.BbgDataHistory import BbgDataHistory
+except ImportError:
+    # The package imports blpapi on import
+    BbgDataHistory = None
+
+def day(i):
+    return dt.date(2020, 1, 1) + dt.timedelta(days = i)
+
+# A only returns PX_LAST, B returns both fields and C returns nothing
+SNAPSHOTS = {
+    'A': [{'date': day(0), 'PX_LAST': 1.0}, {'date': day(2), 'PX_LAST': 1.2}],
+    'B': [{'date': day(0), 'PX_LAST': 2.0, 'PX_BID': 1.9}, {'date': day(1), 'PX_LAST': 2.1, 'PX_BID': 2.0}],
+    'C': []
+}
+
+if BbgDataHistory is not None:
+    class CannedHistory(BbgDataHistory):
+        def constructDf(self):
+            # Builds the frame from canned responses limited to the query's securities and fields, the way the terminal answers
+            self.validateFields()
+            columns = self.newResponseColumns()
+            for security in self.securities:
+                snapshots = [{field: value for field, value in snapshot.items() if field == 'date' or field in self.fields} for snapshot in SNAPSHOTS[security]]
+                snapshots = [snapshot for snapshot in snapshots if len(snapshot) > 1]
+                self.refDataContentToColumns({'content': {'HistoricalDataResponse': {'securityData': {'security': security, 'fieldData': [{'fieldData': snapshot} for snapshot in snapshots]}}}}, columns)
+            return self.responseColumnsToOutput(columns)
+
+@unittest.skipIf(BbgDataHistory is None, 'BloombergData dependencies are not installed')
+class BbgLazyHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.query = CannedHistory(fields = ['PX_LAST', 'PX_BID'], securities = ['A', 'B', 'C'], startDate = '20200101', endDate = '20200110', session = object())
+
+    def testToDfMatchesConstructDf(self):
+        expected = self.query.constructDf()
+        for batchSize in [1, 2, 50]:
+            lazy = self.query.lazy(batchSize = batchSize)
+            pd.testing.assert_frame_equal(lazy.toDf(), expected, check_column_type = False, check_index_type = False)
+        self.assertTrue(expected[('A', 'PX_BID')].isna().all())
+
+    def testReadsSurviveEviction(self):
+        # A cap below a single block evicts everything but the blocks being read
+        lazy = self.query.lazy(batchSize = 2, memoryCap = 1)
+        self.assertEqual(lazy['A', 'PX_LAST'].tolist(), [1.0, 1.2])
+        both = lazy[[('A', 'PX_LAST'), ('B', 'PX_BID')]]
+        self.assertEqual(both[('B', 'PX_BID')].dropna().tolist(), [1.9, 2.0])
+        self.assertEqual(both[('A', 'PX_LAST')].dropna().tolist(), [1.0, 1.2])
+
+    def testFieldCacheIsCarriedToBatches(self):
+        validated = []
+
+        class FieldCache:
+            def validateFields(self, fields, bulk = None):
+                validated.append(list(fields))
+
+            def dtypes(self, fields):
+                return {}
+
+        self.query.fieldCache = FieldCache()
+        self.query.lazy()['B', 'PX_BID']
+        self.assertEqual(validated, [['PX_BID']])
+
+if __name__ == '__main__':
+    unittest.main()
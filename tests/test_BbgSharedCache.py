@@ -0,0 +1,65 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+try:
+    from BloombergData.BbgSharedCache import BbgSharedCache, cacheKey
+except ImportError:
+    # The package imports blpapi and pandas on import
+    BbgSharedCache = None
+    KEYS = []
+else:
+    KEYS = [cacheKey('BbgDataPoint', 'SEC{:03d} Equity'.format(i), 'PX_LAST') for i in range(100)]
+
+WORKERS = 8
+
+def stampedeWorker(path, barrier, fetches, lock, results):
+    cache = BbgSharedCache(path, pollInterval = 0.01)
+
+    def fetcher(keys):
+        with lock:
+            fetches.value += len(keys)
+        # Slow enough for every other worker to miss the same keys while the leaseholder fetches them
+        time.sleep(0.5)
+        return {key: i for i, key in enumerate(KEYS) if key in set(keys)}
+
+    barrier.wait()
+    values = cache.fetch(KEYS, fetcher, ttlFor = lambda key: 3600)
+    results.put(values == {key: i for i, key in enumerate(KEYS)})
+
+@unittest.skipIf(BbgSharedCache is None, 'BloombergData dependencies are not installed')
+class BbgSharedCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'refDataCache.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors = True)
+
+    def testStampedeFetchesEachKeyOnce(self):
+        BbgSharedCache(self.path)
+        barrier = multiprocessing.Barrier(WORKERS)
+        fetches = multiprocessing.Value('i', 0)
+        lock = multiprocessing.Lock()
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target = stampedeWorker, args = (self.path, barrier, fetches, lock, results)) for i in range(WORKERS)]
+        for process in processes:
+            process.start()
+        complete = [results.get(timeout = 60) for process in processes]
+        for process in processes:
+            process.join(timeout = 60)
+
+        self.assertEqual(complete, [True] * WORKERS)
+        self.assertEqual(fetches.value, len(KEYS))
+
+    def testExpiredValuesAreFetchedAgain(self):
+        cache = BbgSharedCache(self.path)
+        cache.put(KEYS[0], 1.0, ttl = -1)
+        self.assertEqual(cache.fetch([KEYS[0]], lambda keys: {key: 2.0 for key in keys}), {KEYS[0]: 2.0})
+        self.assertEqual(cache.get(KEYS[0]), 2.0)
+
+if __name__ == '__main__':
+    unittest.main()
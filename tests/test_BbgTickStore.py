@@ -0,0 +1,79 @@
+import datetime as dt
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import numpy as np
+    from BloombergData.BbgTickStore import BbgTickStore
+except ImportError:
+    # The package imports blpapi and pandas on import
+    BbgTickStore = None
+
+SECURITY = 'YMH0 Comdty'
+DAY = dt.datetime(2020, 1, 30)
+
+def ticks(*rows):
+    # rows are (seconds after DAY, price, size) trades
+    return {
+        'time': [DAY + dt.timedelta(seconds = seconds) for seconds, value, size in rows],
+        'value': [value for seconds, value, size in rows],
+        'size': [size for seconds, value, size in rows],
+        'type': ['TRADE'] * len(rows),
+        'conditionCodes': [''] * len(rows)
+    }
+
+@unittest.skipIf(BbgTickStore is None, 'BloombergData dependencies are not installed')
+class BbgTickStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = BbgTickStore(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors = True)
+
+    def readRows(self):
+        read = self.store.read(SECURITY, DAY, DAY + dt.timedelta(days = 1))
+        seconds = (read['time'] - np.datetime64(DAY, 'ns').astype(np.int64)) // 10**9
+        return list(zip(seconds.tolist(), read['value'].tolist(), read['size'].tolist()))
+
+    def testIdenticalTicksWithinAFetchAreKept(self):
+        self.store.append(SECURITY, ticks((1, 99.0, 5), (2, 99.0, 5), (2, 99.0, 5)))
+        self.store.append(SECURITY, ticks((3, 99.5, 1), (3, 99.5, 1)))
+        self.assertEqual(self.readRows(), [(1, 99.0, 5), (2, 99.0, 5), (2, 99.0, 5), (3, 99.5, 1), (3, 99.5, 1)])
+
+    def testOverlappingFillSkipsStoredTicksOnly(self):
+        self.store.append(SECURITY, ticks((1, 99.0, 5), (2, 99.0, 5), (2, 99.0, 5), (3, 99.5, 1)))
+        # The refetch repeats the stored ticks from 2s on, adds a third identical tick at 2s and a new one at 4s
+        self.store.append(SECURITY, ticks((2, 99.0, 5), (2, 99.0, 5), (2, 99.0, 5), (3, 99.5, 1), (4, 99.5, 2)))
+        self.assertEqual(self.readRows(), [(1, 99.0, 5), (2, 99.0, 5), (2, 99.0, 5), (2, 99.0, 5), (3, 99.5, 1), (4, 99.5, 2)])
+
+    def testStoredTicksOutsideTheOverlapDoNotAbsorbNewTicks(self):
+        self.store.append(SECURITY, ticks((1, 99.0, 5), (5, 99.0, 5)))
+        self.store.append(SECURITY, ticks((2, 99.0, 5), (3, 99.0, 5)))
+        self.assertEqual(self.readRows(), [(1, 99.0, 5), (2, 99.0, 5), (3, 99.0, 5), (5, 99.0, 5)])
+
+    def testMissingIntervals(self):
+        hour = dt.timedelta(hours = 1)
+        self.store.append(SECURITY, ticks((60, 99.0, 1)), covered = (DAY, DAY + hour))
+        self.store.append(SECURITY, ticks((3 * 3600 + 60, 99.0, 1)), covered = (DAY + 3 * hour, DAY + 4 * hour))
+        self.store.append(SECURITY, ticks(), covered = (DAY + 4 * hour, DAY + 5 * hour))
+        self.assertEqual(self.store.coveredIntervals(SECURITY), [(DAY, DAY + hour), (DAY + 3 * hour, DAY + 5 * hour)])
+        self.assertEqual(self.store.missingIntervals(SECURITY, DAY - hour, DAY + 6 * hour), [(DAY - hour, DAY), (DAY + hour, DAY + 3 * hour), (DAY + 5 * hour, DAY + 6 * hour)])
+        self.assertEqual(self.store.missingIntervals(SECURITY, DAY + 3 * hour, DAY + 5 * hour), [])
+
+    def testHalfSwappedPartitionIsReadAndRecovered(self):
+        self.store.append(SECURITY, ticks((1, 99.0, 5), (2, 99.5, 1)))
+        partitionPath = self.store.partitionPath(SECURITY, (DAY - dt.datetime(1970, 1, 1)).days)
+        # A crash between the two renames of a write leaves the previous partition as .old and the new one as .tmp
+        os.replace(partitionPath, partitionPath + '.old')
+        shutil.copytree(partitionPath + '.old', partitionPath + '.tmp')
+        self.assertEqual(self.readRows(), [(1, 99.0, 5), (2, 99.5, 1)])
+
+        self.store.append(SECURITY, ticks((3, 100.0, 2)))
+        self.assertEqual(self.readRows(), [(1, 99.0, 5), (2, 99.5, 1), (3, 100.0, 2)])
+        self.assertEqual(sorted(os.listdir(self.store.securityPath(SECURITY))), ['20200130', 'metadata.json'])
+
+if __name__ == '__main__':
+    unittest.main()